@@ -1,7 +1,7 @@
 # Standard library imports
 import argparse
+import atexit
 import base64
-import configparser
 import datetime
 import getpass
 import json
@@ -10,22 +10,30 @@ import re
 import subprocess
 import sys
 import tempfile
+import threading
 import time
-import urllib.request
 import webbrowser
-from collections import Counter
+from collections import Counter, OrderedDict, defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from contextlib import nullcontext
+from dataclasses import dataclass, field
+from functools import lru_cache, wraps
+from itertools import islice
+from types import MappingProxyType
+from typing import Optional
 
 # Third-party imports
 import colorama
 import requests
-import tiktoken
-from cryptography.fernet import Fernet
-from dotenv import load_dotenv
-from packaging import version
-from rich.console import Console
-from rich.markdown import Markdown
+from dotenv import find_dotenv, load_dotenv
+from requests.adapters import HTTPAdapter
+from rich.console import Console, Group
 from rich.panel import Panel
+from rich.text import Text
 from rich.prompt import Prompt
+from rich.table import Table
+from urllib3.util.request import ACCEPT_ENCODING
+from urllib3.util.retry import Retry
 
 # Optional dependencies with graceful fallbacks
 try:
@@ -34,6 +42,30 @@ try:
 except ImportError:
     HAS_FZF = False
 
+try:
+    import ijson
+    try:
+        # Prefer the C yajl2 backend, the fastest one ijson ships
+        ijson_backend = ijson.get_backend('yajl2_c')
+    except ImportError:
+        ijson_backend = ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+try:
+    import httpx
+    import h2  # noqa: F401 - required by httpx for HTTP/2
+    HAS_HTTP2 = True
+except ImportError:
+    HAS_HTTP2 = False
+
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
 try:
     from prompt_toolkit import prompt
     from prompt_toolkit.auto_suggest import AutoSuggestFromHistory
@@ -61,9 +93,69 @@ APP_VERSION = "1.3.2"
 REPO_URL = "https://github.com/oop7/OrChat"
 API_URL = "https://api.github.com/repos/oop7/OrChat/releases/latest"
 
+# Config, key and session files live next to the script
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_FILE = os.path.join(APP_DIR, 'config.ini')
+ENV_FILE = os.path.join(APP_DIR, '.env')
+KEY_FILE = os.path.join(APP_DIR, '.key')
+
+# Per-session save directories are created under this folder next to the script
+SESSIONS_DIR = os.path.join(APP_DIR, "sessions")
+
+# Settings changed by chat commands are written after this many seconds without further changes
+CONFIG_SAVE_DELAY = 0.5
+
+# HTTP client settings
+HTTP_TIMEOUT = (3.05, 30)  # (connect, read) seconds
+HTTP_POOL_CONNECTIONS = 4
+HTTP_POOL_MAXSIZE = 8
+CHAT_TIMEOUT = (HTTP_TIMEOUT[0], 60)  # slow models may take a while to send the first token
+STREAM_CHUNK_SIZE = 1024  # bytes read per socket read while streaming SSE replies
+
+# The "Waiting for response" spinner only appears once a reply takes longer than this many seconds
+SPINNER_DELAY = 0.3
+
+# Model catalog cache
+MODEL_CACHE_TTL = 300  # seconds
+# Older cached catalogs are still served at once and refreshed in the background until they reach this age
+MODEL_CACHE_MAX_STALE = 24 * 60 * 60  # seconds
+NETWORK_FAILURE_WINDOW = 30  # seconds to skip fallback fetches after a connection error
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".orchat")
+# ORCHAT_MODELS_PATH points the catalog cache at another file, e.g. a pre-seeded one for offline use
+MODELS_CACHE_FILE = os.environ.get("ORCHAT_MODELS_PATH") or os.path.join(CACHE_DIR, "models_cache.json")
+# ORCHAT_DISABLE_REMOTE_MODELS=1 serves model catalogs from the cache only and never fetches them
+REMOTE_MODELS_DISABLED = os.environ.get("ORCHAT_DISABLE_REMOTE_MODELS") == "1"
+
+# Capability filters offered when browsing the enhanced model catalog
+CAPABILITY_FILTERS = ("reasoning", "multipart", "tools", "free")
+
+# Price strings the API uses for free models, matched before falling back to float()
+ZERO_PRICE_STRINGS = frozenset({"0", "0.0", ""})
+
+# Shared read-only defaults for missing model fields, so lookups don't allocate per model
+EMPTY_MAPPING = MappingProxyType({})
+EMPTY_TUPLE = ()
+
+# Texts up to this many characters have their token counts memoized by content
+SHORT_TEXT_MAX_CHARS = 2048
+
+# Tags delimiting the thinking sections emitted by models in thinking mode
+THINKING_OPEN_TAG = "<thinking>"
+THINKING_CLOSE_TAG = "</thinking>"
+
+# Appended to the system instructions while thinking mode is on
+THINKING_INSTRUCTION = (
+    "CRITICAL INSTRUCTION: For EVERY response without exception, you MUST first explain your "
+    "thinking process between <thinking> and </thinking> tags, even for simple greetings or short "
+    "responses. This thinking section should explain your reasoning and approach. "
+    "After the thinking section, provide your final response. Example format:\n"
+    "<thinking>Here I analyze what to say, considering context and appropriate responses...</thinking>\n"
+    "This is my actual response to the user."
+)
+
 # Security & file constraints
 MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB limit
-ALLOWED_FILE_EXTENSIONS = {
+ALLOWED_FILE_EXTENSIONS = frozenset({
     # Text files
     '.txt', '.md', '.json', '.xml', '.csv',
     # Code files  
@@ -72,7 +164,17 @@ ALLOWED_FILE_EXTENSIONS = {
     '.html', '.css',
     # Image files
     '.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp'
-}
+})
+# Shown when a file is rejected; sorted once rather than on every rejection
+ALLOWED_FILE_EXTENSIONS_TEXT = ', '.join(sorted(ALLOWED_FILE_EXTENSIONS))
+
+# File picker directory listings are reused for this long; a directory's mtime
+# changes when files are added or removed but not when a file's size changes
+DIR_LISTING_TTL = 2.0  # seconds
+DIR_LISTING_CACHE_SIZE = 32
+
+# The file picker offers at most this many matches per keystroke
+MAX_FILE_COMPLETIONS = 200
 
 # Global state
 console = Console()
@@ -97,18 +199,396 @@ def format_time_delta(delta_seconds: float) -> str:
         mins, secs = divmod(delta_seconds, 60)
         return f"{int(mins)}m {secs:.1f}s"
 
+@lru_cache(maxsize=1024)
 def format_file_size(size_bytes: int) -> str:
-    """Format file size into human-readable string."""
-    for unit in ['B', 'KB', 'MB', 'GB']:
-        if size_bytes < 1024.0:
-            return f"{size_bytes:.1f} {unit}"
-        size_bytes /= 1024.0
-    return f"{size_bytes:.1f} TB"
+    """Format file size in a human-readable way; sizes repeat a lot, so results are memoized."""
+    if size_bytes < 1024:
+        return f"{size_bytes} bytes"
+    elif size_bytes < 1024 * 1024:
+        return f"{size_bytes / 1024:.1f} KB"
+    elif size_bytes < 1024 * 1024 * 1024:
+        return f"{size_bytes / (1024 * 1024):.1f} MB"
+    else:
+        return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+
+class DelayedStatus:
+    """A console status spinner that is only shown if stop() isn't called within a short delay.
+
+    Quick replies then never start Rich's live-render refresh thread.
+    """
+
+    def __init__(self, message, delay=SPINNER_DELAY):
+        self.status = console.status(message)
+        self.lock = threading.Lock()
+        self.shown = False
+        self.stopped = False
+        self.timer = threading.Timer(delay, self.show)
+        self.timer.daemon = True
+
+    def start(self):
+        self.timer.start()
+
+    def show(self):
+        with self.lock:
+            if not self.stopped:
+                self.status.start()
+                self.shown = True
+
+    def stop(self):
+        self.timer.cancel()
+        with self.lock:
+            self.stopped = True
+            if self.shown:
+                self.status.stop()
+
+# ============================================================================
+# HTTP CLIENT
+# ============================================================================
+
+def create_http_session() -> requests.Session:
+    """Create a pooled keep-alive session with retries for OpenRouter API calls."""
+    session = requests.Session()
+    # ACCEPT_ENCODING lists br/zstd only when urllib3 can decode them (brotli/zstandard installed)
+    session.headers.update({
+        "Connection": "keep-alive",
+        "Accept-Encoding": ACCEPT_ENCODING,
+    })
+    retries = Retry(
+        total=3,
+        backoff_factor=0.3,
+        status_forcelist=[429, 500, 502, 503, 504],
+        raise_on_status=False
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        max_retries=retries
+    )
+    session.mount("https://", adapter)
+    return session
+
+# Shared session so every API call reuses the same TCP/TLS connections
+http_session = create_http_session()
+
+def create_http2_client():
+    """Create an HTTP/2 client so concurrent small API calls multiplex over one TLS connection."""
+    if not HAS_HTTP2:
+        return None
+    return httpx.Client(
+        http2=True,
+        limits=httpx.Limits(
+            max_keepalive_connections=HTTP_POOL_CONNECTIONS,
+            max_connections=HTTP_POOL_MAXSIZE
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT[1], connect=HTTP_TIMEOUT[0])
+    )
+
+# Used for the burst of category lookups when httpx[http2] is installed
+http2_client = create_http2_client()
+
+# Transport-level failures from whichever client carried the request
+if HAS_HTTP2:
+    NETWORK_ERRORS = (requests.exceptions.RequestException, httpx.HTTPError)
+else:
+    NETWORK_ERRORS = (requests.exceptions.RequestException,)
+
+CHAT_COMPLETIONS_URL = "https://openrouter.ai/api/v1/chat/completions"
+
+def post_chat_completion(headers: dict, body: bytes):
+    """POST a streaming chat request, over HTTP/2 when available.
+
+    The returned response must be closed by the caller; error bodies are already read.
+    """
+    if http2_client is None:
+        return http_session.post(CHAT_COMPLETIONS_URL, headers=headers, data=body, stream=True, timeout=CHAT_TIMEOUT)
+
+    request = http2_client.build_request(
+        "POST", CHAT_COMPLETIONS_URL, headers=headers, content=body,
+        timeout=httpx.Timeout(CHAT_TIMEOUT[1], connect=CHAT_TIMEOUT[0])
+    )
+    response = http2_client.send(request, stream=True)
+    if response.status_code != 200:
+        # Error details are read through .json()/.text, which need the body loaded
+        response.read()
+    return response
+
+def iter_response_lines(response):
+    """Yield the lines of a streaming response body as they arrive.
+
+    Raw chunks from either client are appended to one bytearray and lines are sliced
+    out of it, so each line costs a single allocation and no str decoding.
+    """
+    if http2_client is not None and isinstance(response, httpx.Response):
+        chunks = response.iter_bytes()
+    else:
+        chunks = response.iter_content(chunk_size=STREAM_CHUNK_SIZE)
+
+    buffer = bytearray()
+    for data in chunks:
+        buffer += data
+        start = 0
+        end = buffer.find(b"\n")
+        while end != -1:
+            # Drop the \r of CRLF line endings
+            line_end = end - 1 if end > start and buffer[end - 1] == 0x0D else end
+            yield buffer[start:line_end]
+            start = end + 1
+            end = buffer.find(b"\n", start)
+        del buffer[:start]
+    if buffer:
+        yield buffer
+
+def api_get(url: str, headers: dict):
+    """GET a small OpenRouter API resource, over HTTP/2 when available."""
+    if http2_client is not None:
+        return http2_client.get(url, headers=headers)
+    return http_session.get(url, headers=headers, timeout=HTTP_TIMEOUT)
+
+@lru_cache(maxsize=4)
+def get_auth_headers(api_key: str) -> dict:
+    """Build the OpenRouter request headers once per API key."""
+    return {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+    }
+
+def dumps_json(obj) -> bytes:
+    """Serialize obj to UTF-8 JSON bytes, using orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+def loads_json(data):
+    """Decode JSON from bytes or str, using orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def parse_json_response(response):
+    """Decode a JSON response body, using orjson when it is installed."""
+    if HAS_ORJSON:
+        return orjson.loads(response.content)
+    return response.json()
+
+def parse_model_list(response) -> list:
+    """Extract the "data" array of a model catalog response.
+
+    When ijson is installed the response is requested with stream=True and the
+    array items are parsed incrementally from the socket, avoiding a second
+    in-memory copy of the multi-MB payload. Otherwise the body is decoded whole.
+    """
+    if HAS_IJSON and not response.raw.closed:
+        response.raw.decode_content = True
+        return list(ijson_backend.items(response.raw, 'data.item', use_float=True))
+    return parse_json_response(response).get("data", [])
+
+# ETag / Last-Modified validators of each catalog URL and the model list they describe
+catalog_validators = {}
+
+def fetch_model_list(url: str, headers: dict):
+    """GET a model catalog, revalidating a previous copy with a conditional request.
+
+    Returns (status_code, models); models is None when the request failed. A
+    304 Not Modified reply reuses the list from the previous download.
+    """
+    previous = catalog_validators.get(url)
+    if previous:
+        headers = dict(headers)
+        if previous['etag']:
+            headers['If-None-Match'] = previous['etag']
+        if previous['last_modified']:
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    with http_session.get(url, headers=headers, timeout=HTTP_TIMEOUT, stream=HAS_IJSON) as response:
+        if response.status_code == 304 and previous:
+            return 200, previous['models']
+        if response.status_code != 200:
+            return response.status_code, None
+        models = parse_model_list(response)
+
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        catalog_validators[url] = {'etag': etag, 'last_modified': last_modified, 'models': models}
+    return 200, models
+
+# ============================================================================
+# MODEL CACHE
+# ============================================================================
+
+# In-process cache of model catalog fetches: name -> (fetched_at timestamp, value)
+model_cache = {}
+# Names of catalog entries being refetched by a background thread
+refreshing_model_caches = set()
+model_cache_lock = threading.Lock()
+# Set on background refresh threads so their fetches draw no spinners or errors over the prompt
+catalog_refresh = threading.local()
+
+def catalog_status(message: str):
+    """Return a status spinner for a catalog fetch, or a no-op one during a background refresh."""
+    if getattr(catalog_refresh, 'quiet', False):
+        return nullcontext()
+    return console.status(message)
+
+def catalog_warning(message: str) -> None:
+    """Print a catalog fetch problem unless the fetch is a background refresh."""
+    if not getattr(catalog_refresh, 'quiet', False):
+        console.print(message)
+
+def load_disk_model_cache(name: str):
+    """Return the (fetched_at, value) catalog entry saved on disk, whatever its age."""
+    try:
+        with open(MODELS_CACHE_FILE, 'rb') as f:
+            entry = loads_json(f.read()).get(name)
+        if entry:
+            return entry['fetched_at'], entry['data']
+    except (OSError, ValueError, KeyError, TypeError, AttributeError):
+        pass
+    return None
+
+def save_disk_model_cache(name: str, fetched_at: float, value) -> None:
+    """Persist a catalog entry so cold starts can skip the HTTP call."""
+    try:
+        with model_cache_lock:
+            os.makedirs(os.path.dirname(MODELS_CACHE_FILE) or ".", exist_ok=True)
+            try:
+                with open(MODELS_CACHE_FILE, 'rb') as f:
+                    entries = loads_json(f.read())
+            except (OSError, ValueError):
+                entries = {}
+            entries[name] = {'fetched_at': fetched_at, 'data': value}
+            # Swap a complete file in so a concurrent reader never sees half of one
+            temp_file = MODELS_CACHE_FILE + '.tmp'
+            with open(temp_file, 'wb') as f:
+                f.write(dumps_json(entries))
+            os.replace(temp_file, MODELS_CACHE_FILE)
+    except (OSError, TypeError, ValueError):
+        pass  # Caching is best-effort
+
+def fetch_into_model_cache(name: str, func):
+    """Call a catalog fetch and cache a non-empty result in memory and on disk."""
+    fetched_at = time.time()
+    value = func()
+    if value:
+        model_cache[name] = (fetched_at, value)
+        save_disk_model_cache(name, fetched_at, value)
+    return value
+
+def refresh_model_cache_in_background(name: str, func) -> None:
+    """Refetch a stale catalog entry on a daemon thread, one refresh per entry at a time."""
+    with model_cache_lock:
+        if name in refreshing_model_caches:
+            return
+        refreshing_model_caches.add(name)
+
+    def refresh():
+        catalog_refresh.quiet = True
+        try:
+            fetch_into_model_cache(name, func)
+        except Exception:
+            pass  # The stale entry stays in use until the next refresh
+        finally:
+            with model_cache_lock:
+                refreshing_model_caches.discard(name)
+
+    threading.Thread(target=refresh, daemon=True).start()
+
+def ttl_cache(ttl: float = MODEL_CACHE_TTL, offline_result=None):
+    """Memoize a zero-argument catalog fetch in memory and on disk.
+
+    Results younger than ttl are returned as they are. Results up to
+    MODEL_CACHE_MAX_STALE old are returned at once while a background thread
+    refetches them (stale-while-revalidate); anything older is refetched
+    synchronously, falling back to the old result if the fetch fails.
+    Empty results are not cached so a failed fetch is retried on the next call.
+    offline_result builds the value returned when remote catalogs are disabled
+    and nothing is cached.
+    """
+    def decorator(func):
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper():
+            cached = model_cache.get(name)
+            if cached is None:
+                cached = load_disk_model_cache(name)
+                if cached is not None:
+                    model_cache[name] = cached
+
+            if REMOTE_MODELS_DISABLED:
+                if cached is not None:
+                    return cached[1]
+                return offline_result() if offline_result else None
+
+            if cached is not None:
+                age = time.time() - cached[0]
+                if age <= ttl:
+                    return cached[1]
+                if age <= MODEL_CACHE_MAX_STALE:
+                    refresh_model_cache_in_background(name, func)
+                    return cached[1]
+
+            value = fetch_into_model_cache(name, func)
+            if not value and cached is not None:
+                # An outdated catalog is more useful than none while OpenRouter is unreachable
+                return cached[1]
+            return value
+        return wrapper
+    return decorator
+
+# Monotonic timestamp of the last catalog fetch that failed at the network level
+last_network_failure = {'at': None}
+
+def record_network_failure() -> None:
+    """Remember that a catalog fetch could not reach OpenRouter.
+
+    Failures on a background refresh are not recorded, so a blip the user never
+    sees does not change what the foreground is served.
+    """
+    if not getattr(catalog_refresh, 'quiet', False):
+        last_network_failure['at'] = time.monotonic()
+
+def network_recently_failed() -> bool:
+    """Check whether a connection error or timeout happened within NETWORK_FAILURE_WINDOW."""
+    failed_at = last_network_failure['at']
+    return failed_at is not None and time.monotonic() - failed_at < NETWORK_FAILURE_WINDOW
+
+def invalidate_model_cache() -> None:
+    """Drop cached model catalogs so the next call refetches from OpenRouter."""
+    model_cache.clear()
+    try:
+        os.remove(MODELS_CACHE_FILE)
+    except OSError:
+        pass
 
 # ============================================================================
 # COMPLETION CLASSES
 # ============================================================================
 
+def build_prefix_index(entries: dict) -> dict:
+    """Map every prefix of every key to the (key, value) pairs it matches, in dict order."""
+    index = defaultdict(list)
+    for key, value in entries.items():
+        for length in range(len(key) + 1):
+            index[key[:length]].append((key, value))
+    return {prefix: tuple(matches) for prefix, matches in index.items()}
+
+def find_active_hash(text: str, cursor_pos: int) -> int:
+    """Return the index of the '#' starting the file path at the cursor, or -1.
+
+    Walks back from the cursor and stops at the first space or tab, so the cost
+    depends on the length of the path being typed, not of the whole input.
+    """
+    index = cursor_pos - 1
+    while index >= 0:
+        char = text[index]
+        if char == '#':
+            return index
+        if char == ' ' or char == '\t':
+            return -1
+        index -= 1
+    return -1
+
 class OrChatCompleter(Completer):
     """Optimized command completer with descriptions."""
     
@@ -133,6 +613,9 @@ class OrChatCompleter(Completer):
         'thinking-mode': 'Toggle thinking mode on/off',
         'help': 'Show available commands'
     }
+
+    # Matching commands of every typed prefix, so a keystroke is a single dict lookup
+    COMMANDS_BY_PREFIX = build_prefix_index(COMMANDS)
     
     def get_completions(self, document, complete_event):
         """Generate command completions efficiently."""
@@ -141,64 +624,98 @@ class OrChatCompleter(Completer):
             return
             
         command_part = text[1:].lower()
-        for cmd, description in self.COMMANDS.items():
-            if cmd.startswith(command_part):
-                yield Completion(
-                    cmd,
-                    start_position=-len(command_part),
-                    display_meta=description
-                )
+        for cmd, description in self.COMMANDS_BY_PREFIX.get(command_part, ()):
+            yield Completion(
+                cmd,
+                start_position=-len(command_part),
+                display_meta=description
+            )
 
 class FilePickerCompleter(Completer):
     """Optimized file picker completer for # symbol."""
     
     # File type icons (static for performance)
-    FILE_ICONS = {
+    FILE_ICONS = MappingProxyType({
         '.py': '🐍', '.js': '📜', '.ts': '📜', '.java': '☕', '.cpp': '⚙️', '.c': '⚙️',
         '.cs': '💙', '.go': '🐹', '.rb': '💎', '.php': '🐘', '.swift': '🍃',
         '.txt': '📄', '.md': '📝', '.json': '📋', '.xml': '📋', '.html': '🌐',
         '.css': '🎨', '.csv': '📊', '.jpg': '🖼️', '.jpeg': '🖼️', '.png': '🖼️',
         '.gif': '🖼️', '.webp': '🖼️', '.bmp': '🖼️'
-    }
+    })
+
+    # Icon for every extension the picker lists; one lookup both filters and picks the icon
+    LISTED_FILE_ICONS = {**dict.fromkeys(ALLOWED_FILE_EXTENSIONS, '📄'), **FILE_ICONS}
     
-    def get_files_in_directory(self, directory: str = ".", filter_text: str = "") -> list:
-        """Get filtered files with size checking and icons."""
-        try:
-            files = []
-            full_path = os.path.abspath(directory)
-            if not os.path.exists(full_path):
-                return files
-                
-            for item in os.listdir(full_path):
-                # Skip hidden files unless specifically requested
-                if item.startswith('.') and not filter_text.startswith('.'):
+    # Unfiltered listings shared by every picker: (path, mtime_ns) -> (expiry, entries).
+    # Completers are created per prompt, so the cache lives on the class.
+    listing_cache = OrderedDict()
+
+    def scan_directory(self, full_path: str) -> list:
+        """List a directory as sorted (is file, lowercased name, is hidden, (name, display, selectable)) tuples.
+
+        The leading fields are the sort key, so directories sort first, then names
+        alphabetically, with no key function.
+        """
+        listing = []
+        file_icons = self.LISTED_FILE_ICONS
+        # scandir entries carry the file type from the directory listing, and
+        # cache their stat, so each entry costs at most one stat call
+        with os.scandir(full_path) as entries:
+            for entry in entries:
+                item = entry.name
+                if entry.is_dir():
+                    listing.append((False, item.lower(), item.startswith('.'), (item + "/", f"📁 {item}/", True)))
                     continue
-                # Apply case-insensitive filter
-                if filter_text and filter_text.lower() not in item.lower():
+
+                # Unsupported extensions are dropped before the size is looked up.
+                # Same result as os.path.splitext: leading dots never start an extension.
+                stem, _, ext = item.rpartition('.')
+                icon = file_icons.get('.' + ext.lower()) if stem.lstrip('.') else None
+                if icon is None or not entry.is_file():
                     continue
-                
-                item_path = os.path.join(full_path, item)
-                
-                if os.path.isfile(item_path):
-                    file_ext = os.path.splitext(item)[1].lower()
-                    if file_ext in ALLOWED_FILE_EXTENSIONS:
-                        file_size = os.path.getsize(item_path)
-                        icon = self.FILE_ICONS.get(file_ext, '📄')
-                        size_str = format_file_size(file_size)
-                        
-                        if file_size > MAX_FILE_SIZE:
-                            display = f"{icon} {item} ({size_str}) [TOO LARGE]"
-                            files.append((item, display, False))
-                        else:
-                            display = f"{icon} {item} ({size_str})"
-                            files.append((item, display, True))
-                            
-                elif os.path.isdir(item_path):
-                    files.append((item + "/", f"📁 {item}/", True))
-                    
-            # Sort: directories first, then files alphabetically
-            files.sort(key=lambda x: (not x[0].endswith('/'), x[0].lower()))
-            return files
+
+                file_size = entry.stat().st_size
+                size_str = format_file_size(file_size)
+
+                if file_size > MAX_FILE_SIZE:
+                    display = f"{icon} {item} ({size_str}) [TOO LARGE]"
+                    listing.append((True, item.lower(), item.startswith('.'), (item, display, False)))
+                else:
+                    display = f"{icon} {item} ({size_str})"
+                    listing.append((True, item.lower(), item.startswith('.'), (item, display, True)))
+
+        # Sort: directories first, then files alphabetically
+        listing.sort()
+        return listing
+
+    def get_files_in_directory(self, directory: str = ".", filter_text: str = "",
+                               max_results: int = MAX_FILE_COMPLETIONS) -> list:
+        """Get up to max_results filtered files with size checking and icons."""
+        try:
+            full_path = os.path.abspath(directory)
+            key = (full_path, os.stat(full_path).st_mtime_ns)
+            now = time.monotonic()
+
+            cache = self.listing_cache
+            cached = cache.get(key)
+            if cached is not None and cached[0] > now:
+                listing = cached[1]
+            else:
+                listing = self.scan_directory(full_path)
+                cache[key] = (now + DIR_LISTING_TTL, listing)
+                while len(cache) > DIR_LISTING_CACHE_SIZE:
+                    cache.popitem(last=False)
+            cache.move_to_end(key)
+
+            filter_lower = filter_text.lower()
+            # Skip hidden files unless specifically requested
+            show_hidden = filter_text.startswith('.')
+            # The listing is already sorted, so the first matches are the ones to show
+            matches = (
+                entry for _, name_lower, hidden, entry in listing
+                if (show_hidden or not hidden) and filter_lower in name_lower
+            )
+            return list(islice(matches, max_results))
             
         except (OSError, PermissionError):
             return []
@@ -207,16 +724,12 @@ class FilePickerCompleter(Completer):
         """Generate file completions for # symbol anywhere in text."""
         text = document.text
         cursor_pos = document.cursor_position
-        text_before = text[:cursor_pos]
-        hash_index = text_before.rfind('#')
-        
+        # No '#' before the cursor, or whitespace after it (separate word)
+        hash_index = find_active_hash(text, cursor_pos)
         if hash_index == -1:
             return
-            
-        path_part = text_before[hash_index + 1:]
-        # Stop if whitespace found (separate word)
-        if ' ' in path_part or '\t' in path_part:
-            return
+
+        path_part = text[hash_index + 1:cursor_pos]
         
         # Parse directory and filter
         if '/' in path_part:
@@ -245,12 +758,10 @@ class CombinedCompleter(Completer):
     
     def get_completions(self, document, complete_event):
         """Route to appropriate completer based on context."""
-        text = document.text
-        cursor_pos = document.cursor_position
-        
-        if text.startswith('/'):
+        if document.text.startswith('/'):
             yield from self.command_completer.get_completions(document, complete_event)
-        elif '#' in text[:cursor_pos]:
+        else:
+            # The file completer looks for the active '#' itself and yields nothing without one
             yield from self.file_completer.get_completions(document, complete_event)
 
 def create_command_completer():
@@ -295,29 +806,19 @@ def get_user_input_with_completion(history=None):
             # Force completion menu to show
             event.app.current_buffer.start_completion()
         
-        # Add bindings for letters to keep completion active after / or #
-        for char in 'abcdefghijklmnopqrstuvwxyz.-_0123456789':
-            @bindings.add(char)
-            def _(event, char=char):
-                """Keep completion active while typing after / or #"""
-                event.app.current_buffer.insert_text(char)
-                # Trigger completion if we're typing after a '/' or have '#' in the text
-                text = event.app.current_buffer.text
-                cursor_pos = event.app.current_buffer.cursor_position
-                
-                # Check for command completion
-                if text.startswith('/') and len(text) > 1:
-                    event.app.current_buffer.start_completion()
-                # Check for file picker completion (# anywhere before cursor)
-                elif '#' in text[:cursor_pos]:
-                    # Find the last # before cursor
-                    text_before_cursor = text[:cursor_pos]
-                    hash_index = text_before_cursor.rfind('#')
-                    if hash_index != -1:
-                        # Check if we're still in the file path (no spaces after #)
-                        path_part = text_before_cursor[hash_index + 1:]
-                        if ' ' not in path_part and '\t' not in path_part:
-                            event.app.current_buffer.start_completion()
+        def refresh_completion(buffer):
+            """Show completions while the cursor is in a /command or a '#' file path"""
+            if buffer.text.startswith('/') or find_active_hash(buffer.text, buffer.cursor_position) != -1:
+                buffer.start_completion()
+
+        def insert_and_complete(event):
+            """Keep completion active while typing after / or #"""
+            event.app.current_buffer.insert_text(event.data)
+            refresh_completion(event.app.current_buffer)
+
+        # Characters that can continue a command name or file path share one handler
+        for char in 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ.-_0123456789':
+            bindings.add(char)(insert_and_complete)
         
         # Add binding for backspace to retrigger completion
         @bindings.add('backspace')
@@ -325,21 +826,7 @@ def get_user_input_with_completion(history=None):
             """Handle backspace and retrigger completion if needed"""
             if event.app.current_buffer.text:
                 event.app.current_buffer.delete_before_cursor()
-                # Retrigger completion if we still have / at start or # anywhere
-                text = event.app.current_buffer.text
-                cursor_pos = event.app.current_buffer.cursor_position
-                
-                if text.startswith('/'):
-                    event.app.current_buffer.start_completion()
-                elif '#' in text[:cursor_pos]:
-                    # Find the last # before cursor
-                    text_before_cursor = text[:cursor_pos]
-                    hash_index = text_before_cursor.rfind('#')
-                    if hash_index != -1:
-                        # Check if we're still in the file path (no spaces after #)
-                        path_part = text_before_cursor[hash_index + 1:]
-                        if ' ' not in path_part and '\t' not in path_part:
-                            event.app.current_buffer.start_completion()
+                refresh_completion(event.app.current_buffer)
         
         # Add binding for Ctrl+Space to manually trigger completion
         @bindings.add('c-space')
@@ -392,36 +879,62 @@ def get_user_input_with_completion(history=None):
 
 def generate_key() -> bytes:
     """Generate a key for encryption."""
+    # cryptography is only needed once a config with a key is read or written
+    from cryptography.fernet import Fernet
     return Fernet.generate_key()
 
-def encrypt_api_key(api_key: str, key: bytes) -> bytes:
-    """Encrypt API key using Fernet symmetric encryption."""
-    return Fernet(key).encrypt(api_key.encode())
+@lru_cache(maxsize=4)
+def get_fernet(key: bytes):
+    """Return a cached Fernet instance so the key is parsed only once."""
+    from cryptography.fernet import Fernet
+    return Fernet(key)
+
+def encrypt_api_key(api_key: str, key: bytes) -> str:
+    """Encrypt API key using Fernet symmetric encryption.
 
-def decrypt_api_key(encrypted_key: bytes, key: bytes) -> str:
+    Fernet tokens are already URL-safe base64 text, so the result can be
+    stored in the config file as-is.
+    """
+    return get_fernet(key).encrypt(api_key.encode()).decode('ascii')
+
+def decrypt_api_key(encrypted_key, key: bytes) -> str:
     """Decrypt API key using Fernet symmetric encryption."""
     try:
-        return Fernet(key).decrypt(encrypted_key).decode()
+        return get_fernet(key).decrypt(encrypted_key).decode()
     except Exception:
         return None
 
+def open_private_file(path: str, mode: str = 'w', **kwargs):
+    """Open a file for writing, creating it readable by the owner only (0600 on Unix).
+
+    The mode is applied when the file is created, so it is never briefly world-readable.
+    A file that already existed keeps its old mode on open, so it is tightened too.
+    """
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    try:
+        if os.name != 'nt':
+            os.fchmod(fd, 0o600)
+        return os.fdopen(fd, mode, **kwargs)
+    except BaseException:
+        os.close(fd)
+        raise
+
+@lru_cache(maxsize=1)
 def get_or_create_master_key() -> bytes:
     """Get or create master encryption key with secure file permissions."""
-    key_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.key')
+    key_file = KEY_FILE
     
-    if os.path.exists(key_file):
+    try:
         with open(key_file, 'rb') as f:
             return f.read()
+    except FileNotFoundError:
+        pass
     
     # Create new key with secure permissions
     key = generate_key()
-    with open(key_file, 'wb') as f:
+    with open_private_file(key_file, 'wb') as f:
         f.write(key)
     
-    # Set restrictive permissions on Unix-like systems
-    if os.name != 'nt':
-        os.chmod(key_file, 0o600)
-    
     return key
 
 def validate_api_key_format(api_key: str) -> bool:
@@ -446,11 +959,81 @@ def secure_input_api_key() -> str:
         console.print("\n[yellow]API key input cancelled[/yellow]")
         return None
 
+@lru_cache(maxsize=1)
+def get_env_api_key():
+    """Load the .env file once (if there is one) and return OPENROUTER_API_KEY."""
+    dotenv_path = find_dotenv()
+    if dotenv_path:
+        load_dotenv(dotenv_path)
+    return os.getenv("OPENROUTER_API_KEY")
+
+# Boolean spellings accepted in config.ini (the same set configparser understands)
+INI_BOOLEAN_STATES = {'1': True, 'yes': True, 'true': True, 'on': True,
+                      '0': False, 'no': False, 'false': False, 'off': False}
+
+def parse_ini(text: str) -> dict:
+    """Parse config.ini text into {section: {key: value}}.
+
+    Reads the subset of the INI format that configparser writes: keys are
+    lowercased, indented lines continue the previous value and '%%' stands for '%'.
+    """
+    sections = {}
+    values = None
+    key = None
+    for line in text.splitlines():
+        stripped = line.strip()
+        if not stripped:
+            # Blank lines inside a multi-line value are kept; trailing ones are dropped below
+            if key is not None:
+                values[key].append('')
+            continue
+        if stripped[0] in '#;':
+            continue
+        if key is not None and line[0] in ' \t':
+            values[key].append(stripped)
+            continue
+        if stripped[0] == '[' and stripped[-1] == ']':
+            values = sections.setdefault(stripped[1:-1], {})
+            key = None
+            continue
+
+        delimiters = [i for i in (stripped.find('='), stripped.find(':')) if i != -1]
+        if values is None or not delimiters:
+            key = None
+            continue
+        cut = min(delimiters)
+        key = stripped[:cut].rstrip().lower()
+        values[key] = [stripped[cut + 1:].lstrip()]
+
+    return {
+        name: {k: '\n'.join(lines).rstrip().replace('%%', '%') for k, lines in section.items()}
+        for name, section in sections.items()
+    }
+
+def format_ini(sections: dict) -> str:
+    """Format {section: {key: value}} as INI text that parse_ini and configparser can both read."""
+    lines = []
+    for name, section in sections.items():
+        lines.append(f"[{name}]")
+        for key, value in section.items():
+            value = str(value).replace('%', '%%').replace('\n', '\n\t')
+            lines.append(f"{key.lower()} = {value}")
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+def parse_ini_bool(value, default: bool) -> bool:
+    """Convert a config.ini boolean, falling back to default when the key is missing."""
+    if value is None:
+        return default
+    try:
+        return INI_BOOLEAN_STATES[value.lower()]
+    except KeyError:
+        raise ValueError(f"Not a boolean: {value}") from None
+
 def load_config() -> dict:
     """Load configuration from .env file and/or config.ini with optimized handling."""
     # Load from environment first
-    load_dotenv()
-    api_key = os.getenv("OPENROUTER_API_KEY")
+    api_key = get_env_api_key()
 
     # Default configuration
     defaults = {
@@ -466,19 +1049,20 @@ def load_config() -> dict:
     }
 
     # Try to load from config.ini
-    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
-    if not os.path.exists(config_file):
+    try:
+        with open(CONFIG_FILE, encoding='utf-8') as f:
+            config = parse_ini(f.read())
+    except FileNotFoundError:
         return defaults
 
-    config = configparser.ConfigParser()
-    config.read(config_file)
-
     # Load API key (encrypted or plaintext)
     if 'API' in config:
-        if 'OPENROUTER_API_KEY_ENCRYPTED' in config['API']:
+        if 'openrouter_api_key_encrypted' in config['API']:
             try:
-                encrypted_key_b64 = config['API']['OPENROUTER_API_KEY_ENCRYPTED']
-                encrypted_key = base64.b64decode(encrypted_key_b64)
+                encrypted_key = config['API']['openrouter_api_key_encrypted']
+                # Older configs wrapped the Fernet token in a second layer of base64
+                if not encrypted_key.startswith('gAAAAA'):
+                    encrypted_key = base64.b64decode(encrypted_key)
                 master_key = get_or_create_master_key()
                 decrypted_key = decrypt_api_key(encrypted_key, master_key)
                 if decrypted_key:
@@ -487,36 +1071,44 @@ def load_config() -> dict:
                     console.print("[yellow]Warning: Could not decrypt API key. Please re-enter it.[/yellow]")
             except Exception as e:
                 console.print(f"[yellow]Warning: Error decrypting API key: {e}[/yellow]")
-        elif 'OPENROUTER_API_KEY' in config['API'] and config['API']['OPENROUTER_API_KEY']:
-            defaults['api_key'] = config['API']['OPENROUTER_API_KEY']
+        elif config['API'].get('openrouter_api_key'):
+            defaults['api_key'] = config['API']['openrouter_api_key']
 
     # Load settings
     if 'SETTINGS' in config:
         settings = config['SETTINGS']
         defaults.update({
-            'model': settings.get('MODEL', ''),
-            'temperature': settings.getfloat('TEMPERATURE', 0.7),
-            'system_instructions': settings.get('SYSTEM_INSTRUCTIONS', ''),
-            'theme': settings.get('THEME', 'default'),
-            'max_tokens': settings.getint('MAX_TOKENS', 0),
-            'autosave_interval': settings.getint('AUTOSAVE_INTERVAL', 300),
-            'streaming': settings.getboolean('STREAMING', True),
-            'thinking_mode': settings.getboolean('THINKING_MODE', False)
+            'model': settings.get('model', ''),
+            'temperature': float(settings.get('temperature', 0.7)),
+            'system_instructions': settings.get('system_instructions', ''),
+            'theme': settings.get('theme', 'default'),
+            'max_tokens': int(settings.get('max_tokens', 0)),
+            'autosave_interval': int(settings.get('autosave_interval', 300)),
+            'streaming': parse_ini_bool(settings.get('streaming'), True),
+            'thinking_mode': parse_ini_bool(settings.get('thinking_mode'), False)
         })
 
     return defaults
 
+@lru_cache(maxsize=1)
+def get_cached_config() -> dict:
+    """Load the configuration once for API helpers that only need to read it.
+
+    Cleared by save_config() so a changed API key is picked up.
+    """
+    return load_config()
+
 def save_config(config_data: dict) -> None:
     """Save configuration to config.ini with encrypted API key."""
-    config = configparser.ConfigParser()
+    get_cached_config.cache_clear()
+    config = {}
     
     # Handle API key encryption
     if 'OPENROUTER_API_KEY' not in os.environ and config_data.get('api_key'):
         try:
             master_key = get_or_create_master_key()
             encrypted_key = encrypt_api_key(config_data['api_key'], master_key)
-            encrypted_key_b64 = base64.b64encode(encrypted_key).decode('utf-8')
-            config['API'] = {'OPENROUTER_API_KEY_ENCRYPTED': encrypted_key_b64}
+            config['API'] = {'OPENROUTER_API_KEY_ENCRYPTED': encrypted_key}
         except Exception as e:
             console.print(f"[yellow]Warning: Could not encrypt API key: {e}. Saving in plaintext.[/yellow]")
             config['API'] = {'OPENROUTER_API_KEY': config_data['api_key']}
@@ -535,150 +1127,244 @@ def save_config(config_data: dict) -> None:
         'THINKING_MODE': str(config_data['thinking_mode'])
     }
 
-    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
+    config_file = CONFIG_FILE
     
+    # Write a temporary file and swap it in so an interrupted save never leaves a truncated config
+    temp_file = config_file + '.tmp'
     try:
-        with open(config_file, 'w', encoding="utf-8") as f:
-            config.write(f)
-        
-        # Set restrictive permissions on Unix-like systems
-        if os.name != 'nt':
-            os.chmod(config_file, 0o600)
-            
+        with open_private_file(temp_file, 'w', encoding="utf-8") as f:
+            f.write(format_ini(config))
+
+        os.replace(temp_file, config_file)
     except Exception as e:
         console.print(f"[red]Error saving configuration: {e}[/red]")
-        
-        console.print("[green]Configuration saved successfully![/green]")
-    except Exception as e:
-        console.print(f"[red]Error saving configuration: {str(e)}[/red]")
 
-def count_tokens(text, model_name="cl100k_base"):
-    """Counts the number of tokens in a given text string using tiktoken."""
+# Debounced save started by schedule_config_save: the pending timer and the config it will write
+pending_config_save = {'timer': None, 'config': None}
+pending_config_lock = threading.Lock()
+
+def schedule_config_save(config_data: dict) -> None:
+    """Save the configuration once CONFIG_SAVE_DELAY passes without another change."""
+    with pending_config_lock:
+        if pending_config_save['timer'] is not None:
+            pending_config_save['timer'].cancel()
+        timer = threading.Timer(CONFIG_SAVE_DELAY, flush_config_save)
+        timer.daemon = True
+        pending_config_save['timer'] = timer
+        pending_config_save['config'] = config_data
+        timer.start()
+
+def flush_config_save() -> None:
+    """Write a scheduled configuration save now, if one is pending."""
+    with pending_config_lock:
+        if pending_config_save['timer'] is not None:
+            pending_config_save['timer'].cancel()
+        config_data = pending_config_save['config']
+        pending_config_save['timer'] = None
+        pending_config_save['config'] = None
+    if config_data is not None:
+        save_config(config_data)
+
+# Settings changed just before exiting are still written
+atexit.register(flush_config_save)
+
+@lru_cache(maxsize=16)
+def get_token_encoding(model_name="cl100k_base"):
+    """Return the tiktoken encoding for a model, resolved once per model name."""
+    # tiktoken is imported on first use; chat_with_model warms this up in the background
+    import tiktoken
     try:
         # tiktoken.encoding_for_model will raise a KeyError if the model is not found.
-        encoding = tiktoken.encoding_for_model(model_name)
+        return tiktoken.encoding_for_model(model_name)
     except KeyError:
         # Fallback to a default encoding for unknown models
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
 
-    tokens = encoding.encode(text)
-    return len(tokens)
+@lru_cache(maxsize=4096)
+def count_short_text_tokens(text, model_name="cl100k_base"):
+    """Memoized token count for short strings such as chat messages and prompts."""
+    return len(get_token_encoding(model_name).encode_ordinary(text))
 
+def count_tokens(text, model_name="cl100k_base"):
+    """Counts the number of tokens in a given text string using tiktoken."""
+    if len(text) <= SHORT_TEXT_MAX_CHARS:
+        return count_short_text_tokens(text, model_name)
+    # Long texts (attachments, long replies) are counted directly rather than kept as cache keys.
+    # encode_ordinary counts special-token text such as "<|endoftext|>" as plain text instead of raising.
+    return len(get_token_encoding(model_name).encode_ordinary(text))
+
+@ttl_cache(offline_result=list)
 def get_available_models():
     """Fetch available models from OpenRouter API"""
     try:
-        config = load_config()
-        headers = {
-            "Authorization": f"Bearer {config['api_key']}",
-            "Content-Type": "application/json",
-        }
+        config = get_cached_config()
+        headers = get_auth_headers(config['api_key'])
 
-        with console.status("[bold green]Fetching available models..."):
-            response = requests.get("https://openrouter.ai/api/v1/models", headers=headers)
+        with catalog_status("[bold green]Fetching available models..."):
+            status_code, models = fetch_model_list("https://openrouter.ai/api/v1/models", headers)
 
-        if response.status_code == 200:
-            models_data = response.json()
-            return models_data["data"]
-        console.print(f"[red]Error fetching models: {response.status_code}[/red]")
+        if models is not None:
+            return models
+        catalog_warning(f"[red]Error fetching models: {status_code}[/red]")
         return []
     except Exception as e:
-        console.print(f"[red]Error fetching models: {str(e)}[/red]")
+        catalog_warning(f"[red]Error fetching models: {str(e)}[/red]")
         return []
 
+# Lookup table for get_model_info, rebuilt whenever the cached catalog is refreshed
+models_index = {'source': None, 'by_id': {}}
+
+def get_models_index():
+    """Return a dict of available models keyed by model id"""
+    models = get_available_models()
+    if models is not models_index['source']:
+        models_index['by_id'] = {model["id"]: model for model in models if model and "id" in model}
+        models_index['source'] = models
+    return models_index['by_id']
+
 def get_model_info(model_id):
     """Get model information of all models"""
-    models = get_available_models()
-    
     try:
-        for model in models:
-            if model["id"] == model_id:
-                return model
-        
-        console.print(f"[yellow]Warning: Could not find info for model '{model_id}'.[/yellow]")
-        return None
+        model = get_models_index().get(model_id)
+        if model is None:
+            console.print(f"[yellow]Warning: Could not find info for model '{model_id}'.[/yellow]")
+        return model
     except Exception as e:
         console.print(f"[red] Failed to fetch model info: {str(e)}[/red]")
         return None
 
-def get_enhanced_models():
-    """Fetch enhanced model data from OpenRouter frontend API with detailed capabilities"""
+@ttl_cache()
+def fetch_enhanced_models():
+    """Fetch enhanced model data from OpenRouter frontend API, or None on failure"""
+    if network_recently_failed():
+        # Don't pay another connect timeout per call while the network is down;
+        # ttl_cache keeps serving any cached catalog in the meantime
+        return None
     try:
-        config = load_config()
-        headers = {
-            "Authorization": f"Bearer {config['api_key']}",
-            "Content-Type": "application/json",
-        }
+        config = get_cached_config()
+        headers = get_auth_headers(config['api_key'])
 
-        with console.status("[bold green]Fetching enhanced model data..."):
-            response = requests.get("https://openrouter.ai/api/frontend/models", headers=headers)
+        with catalog_status("[bold green]Fetching enhanced model data..."):
+            status_code, models = fetch_model_list("https://openrouter.ai/api/frontend/models", headers)
 
-        if response.status_code == 200:
-            models_data = response.json()
-            return models_data.get("data", [])
-        else:
-            console.print(f"[red]Error fetching enhanced models: {response.status_code}[/red]")
-            # Fallback to standard models API
-            return get_available_models()
+        if models is not None:
+            return models
+        catalog_warning(f"[red]Error fetching enhanced models: {status_code}[/red]")
+        return None
+    except (requests.ConnectionError, requests.Timeout) as e:
+        record_network_failure()
+        catalog_warning(f"[red]Error fetching enhanced models: {str(e)}[/red]")
+        return None
     except Exception as e:
-        console.print(f"[red]Error fetching enhanced models: {str(e)}[/red]")
-        # Fallback to standard models API
+        catalog_warning(f"[red]Error fetching enhanced models: {str(e)}[/red]")
+        return None
+
+def get_enhanced_models():
+    """Get enhanced model data with detailed capabilities, falling back to the standard models API"""
+    enhanced_models = fetch_enhanced_models()
+    if enhanced_models is None:
+        if network_recently_failed():
+            return stale_available_models()
+        # HTTP errors still get the standard models API as a fallback
         return get_available_models()
+    return enhanced_models
+
+def stale_available_models():
+    """Return the standard model list held in memory, even if expired."""
+    cached = model_cache.get(get_available_models.__name__)
+    return cached[1] if cached else []
+
+def is_zero_price(raw_price) -> bool:
+    """Check whether an API price value is zero without parsing the common string forms"""
+    if raw_price is None:
+        return True
+    if isinstance(raw_price, str):
+        if raw_price in ZERO_PRICE_STRINGS:
+            return True
+        try:
+            return float(raw_price) == 0
+        except ValueError:
+            return False
+    if isinstance(raw_price, (int, float)):
+        return raw_price == 0
+    return False
+
+@dataclass
+class ModelIndices:
+    """Capability, group and provider indices built in a single pass over the enhanced catalog"""
+    by_capability: dict = field(default_factory=dict)
+    by_group: dict = field(default_factory=dict)
+    by_provider: dict = field(default_factory=dict)
+
+# Indices for the browse functions, rebuilt whenever the cached enhanced catalog is refreshed
+model_indices_cache = {'source': None, 'indices': None}
+
+def build_model_indices():
+    """Build capability, group and provider indices with one walk over the enhanced models"""
+    enhanced_models = get_enhanced_models()
+    if enhanced_models is model_indices_cache['source'] and model_indices_cache['indices'] is not None:
+        return model_indices_cache['indices']
+
+    indices = ModelIndices(by_capability={capability: [] for capability in CAPABILITY_FILTERS})
+    by_capability = indices.by_capability
+    groups = defaultdict(list)
+    providers = defaultdict(list)
+
+    for model in enhanced_models:
+        # Skip None models
+        if model is None:
+            continue
+
+        groups[model.get('group', 'Other')].append(model)
+
+        # Extract capability information from the endpoint data
+        endpoint = model.get('endpoint', EMPTY_MAPPING)
+        if endpoint is None:
+            continue
+
+        providers[endpoint.get('provider_name', 'Unknown')].append(model)
+
+        # Check if model supports reasoning/thinking
+        supports_reasoning = endpoint.get('supports_reasoning', False)
+        reasoning_config = model.get('reasoning_config') or endpoint.get('reasoning_config')
+        if supports_reasoning or reasoning_config:
+            by_capability["reasoning"].append(model)
+
+        # Check if model supports multipart (images/files)
+        supports_multipart = endpoint.get('supports_multipart', False)
+        input_modalities = model.get('input_modalities') or EMPTY_TUPLE
+        if supports_multipart or ('image' in input_modalities):
+            by_capability["multipart"].append(model)
+
+        # Check if model supports tool parameters
+        supports_tools = endpoint.get('supports_tool_parameters', False)
+        supported_params = endpoint.get('supported_parameters') or EMPTY_TUPLE
+        if supports_tools or 'tools' in supported_params:
+            by_capability["tools"].append(model)
+
+        # Check if model is free; pricing is only looked at when the flag is not set
+        if endpoint.get('is_free', False) or is_zero_price((endpoint.get('pricing') or EMPTY_MAPPING).get('prompt')):
+            by_capability["free"].append(model)
+
+    indices.by_group = dict(groups)
+    indices.by_provider = dict(providers)
+
+    model_indices_cache['source'] = enhanced_models
+    model_indices_cache['indices'] = indices
+    return indices
 
 def get_models_by_capability(capability_filter="all"):
-    """Get models filtered by specific capabilities using the enhanced frontend API"""
+    """Get models filtered by specific capabilities using the enhanced frontend API
+
+    The returned list is shared with the model cache and must be treated as read-only.
+    """
+    if capability_filter == "all":
+        # Zero-work alias: hand back the cached catalog without building any index
+        return get_enhanced_models()
+
     try:
-        enhanced_models = get_enhanced_models()
-        
-        if capability_filter == "all":
-            return enhanced_models
-        
-        filtered_models = []
-        
-        for model in enhanced_models:
-            # Skip None models
-            if model is None:
-                continue
-                
-            # Extract capability information from the endpoint data
-            endpoint = model.get('endpoint', {})
-            if endpoint is None:
-                continue
-            
-            if capability_filter == "reasoning":
-                # Check if model supports reasoning/thinking
-                supports_reasoning = endpoint.get('supports_reasoning', False)
-                reasoning_config = model.get('reasoning_config') or endpoint.get('reasoning_config')
-                if supports_reasoning or reasoning_config:
-                    filtered_models.append(model)
-                    
-            elif capability_filter == "multipart":
-                # Check if model supports multipart (images/files)
-                supports_multipart = endpoint.get('supports_multipart', False)
-                input_modalities = model.get('input_modalities', [])
-                if supports_multipart or ('image' in input_modalities):
-                    filtered_models.append(model)
-                    
-            elif capability_filter == "tools":
-                # Check if model supports tool parameters
-                supports_tools = endpoint.get('supports_tool_parameters', False)
-                supported_params = endpoint.get('supported_parameters', [])
-                if supported_params is None:
-                    supported_params = []
-                if supports_tools or 'tools' in supported_params:
-                    filtered_models.append(model)
-                    
-            elif capability_filter == "free":
-                # Check if model is free
-                is_free = endpoint.get('is_free', False)
-                pricing = endpoint.get('pricing', {})
-                if pricing is None:
-                    pricing = {}
-                prompt_price = float(pricing.get('prompt', '0'))
-                if is_free or prompt_price == 0:
-                    filtered_models.append(model)
-                    
-        return filtered_models
-        
+        return build_model_indices().by_capability.get(capability_filter, EMPTY_TUPLE)
+
     except Exception as e:
         console.print(f"[red]Error filtering models by capability: {str(e)}[/red]")
         # Fallback to standard models
@@ -687,21 +1373,8 @@ def get_models_by_capability(capability_filter="all"):
 def get_models_by_group():
     """Get models organized by their groups using enhanced API"""
     try:
-        enhanced_models = get_enhanced_models()
-        groups = {}
-        
-        for model in enhanced_models:
-            # Skip None models
-            if model is None:
-                continue
-                
-            group = model.get('group', 'Other')
-            if group not in groups:
-                groups[group] = []
-            groups[group].append(model)
-        
-        return groups
-        
+        return build_model_indices().by_group
+
     except Exception as e:
         console.print(f"[red]Error grouping models: {str(e)}[/red]")
         return {}
@@ -709,113 +1382,203 @@ def get_models_by_group():
 def get_models_by_provider():
     """Get models organized by their providers using enhanced API"""
     try:
-        enhanced_models = get_enhanced_models()
-        providers = {}
-        
-        for model in enhanced_models:
-            # Skip None models
-            if model is None:
-                continue
-                
-            endpoint = model.get('endpoint', {})
-            if endpoint is None:
-                continue
-                
-            provider = endpoint.get('provider_name', 'Unknown')
-            if provider not in providers:
-                providers[provider] = []
-            providers[provider].append(model)
-        
-        return providers
-        
+        return build_model_indices().by_provider
+
     except Exception as e:
         console.print(f"[red]Error organizing models by provider: {str(e)}[/red]")
         return {}
 
-def get_models_by_categories(categories):
-    """Fetch models by categories from OpenRouter API using the find endpoint"""
+def find_models_by_categories(categories, show_status=True):
+    """Fetch raw model entries for categories from the OpenRouter find endpoint, or None on failure
+
+    Pass show_status=False when calling from worker threads, since Rich only
+    allows one live status display at a time.
+    """
     try:
-        config = load_config()
-        headers = {
-            "Authorization": f"Bearer {config['api_key']}",
-            "Content-Type": "application/json",
-        }
+        config = get_cached_config()
+        headers = get_auth_headers(config['api_key'])
 
         # Convert categories list to comma-separated string for the API
         categories_param = ",".join(categories) if isinstance(categories, list) else categories
         
-        with console.status(f"[bold green]Fetching models for categories: {categories_param}..."):
-            response = requests.get(
+        status = catalog_status(f"[bold green]Fetching models for categories: {categories_param}...") if show_status else nullcontext()
+        with status:
+            response = api_get(
                 f"https://openrouter.ai/api/frontend/models/find?categories={categories_param}",
-                headers=headers
+                headers
             )
 
         if response.status_code == 200:
-            models_data = response.json()
-            # Extract model slugs from the response
+            models_data = parse_json_response(response)
             if "data" in models_data and "models" in models_data["data"]:
-                return [model["slug"] for model in models_data["data"]["models"]]
+                return models_data["data"]["models"]
             return []
         else:
-            console.print(f"[red]Error fetching models by categories: {response.status_code}[/red]")
-            return []
+            catalog_warning(f"[red]Error fetching models by categories: {response.status_code}[/red]")
+            return None
     except Exception as e:
-        console.print(f"[red]Error fetching models by categories: {str(e)}[/red]")
-        return []
+        catalog_warning(f"[red]Error fetching models by categories: {str(e)}[/red]")
+        return None
 
-def get_dynamic_task_categories():
-    """Get dynamic task categories by fetching models from specific OpenRouter categories"""
-    # Map our task types to OpenRouter categories and fallback model patterns
-    category_mapping = {
-        "creative": {
-            "openrouter_categories": ["Programming", "Technology"],  # OpenRouter categories that might contain creative models
-            "fallback_patterns": ["claude-3", "gpt-4", "llama", "gemini"]  # Fallback to original patterns
-        },
-        "coding": {
-            "openrouter_categories": ["Programming", "Technology"],
-            "fallback_patterns": ["claude-3-opus", "gpt-4", "deepseek-coder", "qwen-coder", "devstral", "codestral"]
-        },
-        "analysis": {
-            "openrouter_categories": ["Science", "Academia"],
-            "fallback_patterns": ["claude-3-opus", "gpt-4", "mistral", "qwen"]
-        },
-        "chat": {
-            "openrouter_categories": ["Programming"],  # General chat category
-            "fallback_patterns": ["claude-3-haiku", "gpt-3.5", "gemini-pro", "llama"]
-        }
+def get_models_by_categories(categories, show_status=True):
+    """Fetch model slugs by categories from OpenRouter API using the find endpoint"""
+    models = find_models_by_categories(categories, show_status)
+    # Extract model slugs from the response
+    return [model["slug"] for model in models] if models else []
+
+# Map our task types to OpenRouter categories and fallback model patterns
+TASK_CATEGORY_MAPPING = {
+    "creative": {
+        "openrouter_categories": ["Programming", "Technology"],  # OpenRouter categories that might contain creative models
+        "fallback_patterns": ["claude-3", "gpt-4", "llama", "gemini"]  # Fallback to original patterns
+    },
+    "coding": {
+        "openrouter_categories": ["Programming", "Technology"],
+        "fallback_patterns": ["claude-3-opus", "gpt-4", "deepseek-coder", "qwen-coder", "devstral", "codestral"]
+    },
+    "analysis": {
+        "openrouter_categories": ["Science", "Academia"],
+        "fallback_patterns": ["claude-3-opus", "gpt-4", "mistral", "qwen"]
+    },
+    "chat": {
+        "openrouter_categories": ["Programming"],  # General chat category
+        "fallback_patterns": ["claude-3-haiku", "gpt-3.5", "gemini-pro", "llama"]
     }
+}
 
-    dynamic_categories = {}
-    
-    for task_type, config in category_mapping.items():
+def compile_substring_patterns(patterns):
+    """Compile lowercased literal substrings into one alternation so a lowercased string is scanned once"""
+    return re.compile("|".join(re.escape(pattern.lower()) for pattern in patterns))
+
+# Fallback patterns of each task type, compiled once at import time
+TASK_PATTERN_REGEXES = {
+    task_type: compile_substring_patterns(config["fallback_patterns"])
+    for task_type, config in TASK_CATEGORY_MAPPING.items()
+}
+
+@ttl_cache()
+def fetch_task_category_models():
+    """Fetch the models of every task category with a single find request"""
+    all_categories = sorted({
+        category
+        for config in TASK_CATEGORY_MAPPING.values()
+        for category in config["openrouter_categories"]
+    })
+    return find_models_by_categories(all_categories)
+
+def get_model_category_tags(model):
+    """Return the lowercased category names tagged on a find result, or None if it has none"""
+    categories = model.get("categories")
+    if not categories:
+        return None
+    tags = set()
+    for category in categories:
+        if isinstance(category, dict):
+            category = category.get("name") or category.get("slug")
+        if isinstance(category, str):
+            tags.add(category.lower())
+    return tags or None
+
+def partition_models_by_category_sets(models, category_sets):
+    """Split a combined find response into slug lists per category set
+
+    Returns None when the entries carry no category tags, since the combined
+    response then cannot be attributed to individual categories.
+    """
+    if not models:
+        return None
+    wanted = {category_set: {category.lower() for category in category_set} for category_set in category_sets}
+    results = {category_set: [] for category_set in category_sets}
+    for model in models:
+        tags = get_model_category_tags(model)
+        if tags is None:
+            return None
+        for category_set, categories in wanted.items():
+            if not tags.isdisjoint(categories):
+                results[category_set].append(model["slug"])
+    return results
+
+def run_with_catalog_quiet(quiet, func, *args):
+    """Call func on a pool worker with the submitting thread's background-refresh quiet flag."""
+    catalog_refresh.quiet = quiet
+    return func(*args)
+
+@ttl_cache(offline_result=dict)
+def fetch_task_categories():
+    """Fetch model slugs for each task type from its OpenRouter categories
+
+    Task types whose categories returned no models are left out. Returns None
+    when no category lookup succeeded, so a previously cached result is kept.
+    """
+    # Several task types share the same category set, so only query each unique set once
+    unique_category_sets = {tuple(config["openrouter_categories"]) for config in TASK_CATEGORY_MAPPING.values()}
+
+    # Prefer one request for the union of all categories, partitioned by the category tags on each model
+    results_by_category_set = partition_models_by_category_sets(fetch_task_category_models(), unique_category_sets)
+
+    if results_by_category_set is None:
+        # No per-model tags: the lookups are independent network calls, so fetch them concurrently.
+        # Workers inherit the quiet flag so a background refresh prints nothing from them either.
+        quiet = getattr(catalog_refresh, 'quiet', False)
+        results_by_category_set = {}
+        with catalog_status("[bold green]Fetching models for task categories..."):
+            with ThreadPoolExecutor(max_workers=len(unique_category_sets)) as executor:
+                futures = {
+                    executor.submit(run_with_catalog_quiet, quiet, find_models_by_categories, list(category_set), False): category_set
+                    for category_set in unique_category_sets
+                }
+                for future in as_completed(futures):
+                    models = future.result()
+                    if models is not None:
+                        results_by_category_set[futures[future]] = [model["slug"] for model in models]
+        if not results_by_category_set:
+            return None
+
+    task_categories = {}
+    for task_type, config in TASK_CATEGORY_MAPPING.items():
+        category_models = results_by_category_set.get(tuple(config["openrouter_categories"]))
+        if category_models:
+            # Filter to get relevant models based on fallback patterns for better accuracy
+            pattern_search = TASK_PATTERN_REGEXES[task_type].search
+            filtered_models = [model_slug for model_slug in category_models if pattern_search(model_slug.lower())]
+
+            # If we found filtered models, use them, otherwise use all category models
+            task_categories[task_type] = filtered_models if filtered_models else category_models[:10]  # Limit to 10 for performance
+    return task_categories
+
+def get_dynamic_task_categories():
+    """Get dynamic task categories by fetching models from specific OpenRouter categories
+
+    Task types without category results are matched against the full catalog with
+    their fallback patterns; those matches are never cached as category results.
+    """
+    category_mapping = TASK_CATEGORY_MAPPING
+    # Copied because the cached category result must not pick up the fallback matches
+    dynamic_categories = dict(fetch_task_categories() or EMPTY_MAPPING)
+
+    # Task types whose categories returned nothing are matched against the full catalog
+    fallback_task_types = [task_type for task_type in category_mapping if task_type not in dynamic_categories]
+
+    if fallback_task_types:
+        # Fallback to pattern-based filtering with all available models, in a single pass
+        # that lowercases each model id once and checks it against every pending task type
         try:
-            # Try to get models from OpenRouter categories first
-            category_models = get_models_by_categories(config["openrouter_categories"])
-            
-            if category_models:
-                # Filter to get relevant models based on fallback patterns for better accuracy
-                filtered_models = []
-                for model_slug in category_models:
-                    if any(pattern in model_slug.lower() for pattern in config["fallback_patterns"]):
-                        filtered_models.append(model_slug)
-                
-                # If we found filtered models, use them, otherwise use all category models
-                dynamic_categories[task_type] = filtered_models if filtered_models else category_models[:10]  # Limit to 10 for performance
-            else:
-                # Fallback to pattern-based filtering with all available models
-                all_models = get_available_models()
-                fallback_models = []
-                for model in all_models:
-                    model_id = model.get('id', '').lower()
-                    if any(pattern in model_id for pattern in config["fallback_patterns"]):
-                        fallback_models.append(model['id'])
-                
-                dynamic_categories[task_type] = fallback_models[:10]  # Limit to 10 for performance
-                        
+            pattern_searches = {task_type: TASK_PATTERN_REGEXES[task_type].search for task_type in fallback_task_types}
+            fallback_models = {task_type: [] for task_type in fallback_task_types}
+            for model in get_available_models():
+                model_id = model.get('id', '')
+                model_id_lower = model_id.lower()
+                for task_type, pattern_search in pattern_searches.items():
+                    if pattern_search(model_id_lower):
+                        fallback_models[task_type].append(model_id)
+
+            for task_type in fallback_task_types:
+                dynamic_categories[task_type] = fallback_models[task_type][:10]  # Limit to 10 for performance
         except Exception as e:
-            console.print(f"[yellow]Warning: Failed to get dynamic categories for {task_type}: {str(e)}[/yellow]")
-            # Use fallback patterns in case of error
-            dynamic_categories[task_type] = config["fallback_patterns"]
+            for task_type in fallback_task_types:
+                catalog_warning(f"[yellow]Warning: Failed to get dynamic categories for {task_type}: {str(e)}[/yellow]")
+                # Use fallback patterns in case of error
+                dynamic_categories[task_type] = category_mapping[task_type]["fallback_patterns"]
     
     return dynamic_categories
 
@@ -828,15 +1591,17 @@ def select_model(config):
         return None
 
     # Option to directly enter a model name
-    console.print("[bold green]Model Selection[/bold green]")
-    console.print("\n[bold magenta]Options:[/bold magenta]")
-    console.print("[bold]1[/bold] - View all available models")
-    console.print("[bold]2[/bold] - Show free models only")
-    console.print("[bold]3[/bold] - Enter model name directly")
-    console.print("[bold]4[/bold] - Browse models by task category")
-    console.print("[bold]5[/bold] - Browse by capabilities (enhanced)")
-    console.print("[bold]6[/bold] - Browse by model groups")
-    console.print("[bold]q[/bold] - Cancel selection")
+    console.print(
+        "[bold green]Model Selection[/bold green]\n"
+        "\n[bold magenta]Options:[/bold magenta]\n"
+        "[bold]1[/bold] - View all available models\n"
+        "[bold]2[/bold] - Show free models only\n"
+        "[bold]3[/bold] - Enter model name directly\n"
+        "[bold]4[/bold] - Browse models by task category\n"
+        "[bold]5[/bold] - Browse by capabilities (enhanced)\n"
+        "[bold]6[/bold] - Browse by model groups\n"
+        "[bold]q[/bold] - Cancel selection"
+    )
 
     choice = Prompt.ask("Select an option", choices=["1", "2", "3", "4", "5", "6", "q"], default="1")
 
@@ -1108,7 +1873,7 @@ def select_model(config):
                             continue
                             
                         # Show enhanced model information
-                        endpoint = model.get('endpoint', {}) if model else {}
+                        endpoint = model.get('endpoint', EMPTY_MAPPING) if model else EMPTY_MAPPING
                         # Try multiple fields for model name
                         model_name = model.get('slug') or model.get('name') or model.get('short_name', 'Unknown') if model else 'Unknown'
                         
@@ -1121,13 +1886,13 @@ def select_model(config):
                                 end_token = reasoning_config.get('end_token', '</thinking>')
                                 extra_info = f" [dim]({start_token}...{end_token})[/dim]"
                         elif selected_capability == "multipart":
-                            input_modalities = model.get('input_modalities', []) if model else []
+                            input_modalities = model.get('input_modalities', EMPTY_TUPLE) if model else EMPTY_TUPLE
                             if input_modalities:
                                 extra_info = f" [dim]({', '.join(input_modalities)})[/dim]"
                         elif selected_capability == "tools":
-                            supported_params = endpoint.get('supported_parameters', []) if endpoint else []
+                            supported_params = endpoint.get('supported_parameters', EMPTY_TUPLE) if endpoint else EMPTY_TUPLE
                             if supported_params is None:
-                                supported_params = []
+                                supported_params = EMPTY_TUPLE
                             tool_params = [p for p in supported_params if 'tool' in p.lower()]
                             if tool_params:
                                 extra_info = f" [dim]({', '.join(tool_params)})[/dim]"
@@ -1221,7 +1986,7 @@ def select_model(config):
                         if model is None:
                             continue
                             
-                        endpoint = model.get('endpoint', {}) if model else {}
+                        endpoint = model.get('endpoint', EMPTY_MAPPING) if model else EMPTY_MAPPING
                         model_name = model.get('slug') or model.get('name') or model.get('short_name', 'Unknown') if model else 'Unknown'
                         provider = endpoint.get('provider_name', 'Unknown') if endpoint else 'Unknown'
                         
@@ -1230,7 +1995,7 @@ def select_model(config):
                         if endpoint and endpoint.get('is_free', False):
                             pricing_info = " [green](FREE)[/green]"
                         elif endpoint:
-                            pricing = endpoint.get('pricing', {})
+                            pricing = endpoint.get('pricing', EMPTY_MAPPING)
                             if pricing:
                                 prompt_price = pricing.get('prompt', '0')
                                 try:
@@ -1303,7 +2068,7 @@ def auto_detect_thinking_mode(config, selected_model):
             model_slug = model.get('slug') or model.get('name') or model.get('short_name', '')
             if model_slug == selected_model:
                 # Check if model supports reasoning/thinking
-                endpoint = model.get('endpoint', {})
+                endpoint = model.get('endpoint', EMPTY_MAPPING)
                 supports_reasoning = endpoint.get('supports_reasoning', False) if endpoint else False
                 reasoning_config = model.get('reasoning_config') or (endpoint.get('reasoning_config') if endpoint else None)
                 
@@ -1329,69 +2094,78 @@ def auto_detect_thinking_mode(config, selected_model):
         console.print(f"[yellow]Could not auto-detect thinking mode: {str(e)}[/yellow]")
         console.print(f"[dim]Keeping current setting: {'enabled' if config['thinking_mode'] else 'disabled'}[/dim]")
 
-def get_model_pricing_info(model_name):
-    """Get pricing information for a specific model"""
-    try:
-        enhanced_models = get_enhanced_models()
-        
+# Enhanced models grouped by slug for get_model_pricing_info, rebuilt whenever the catalog changes
+enhanced_models_index = {'source': None, 'by_slug': {}}
+
+def get_enhanced_models_by_slug():
+    """Return enhanced models keyed by slug, each mapping to its matches in catalog order"""
+    enhanced_models = get_enhanced_models()
+    if enhanced_models is not enhanced_models_index['source']:
+        by_slug = defaultdict(list)
         for model in enhanced_models:
             if model is None:
                 continue
-                
-            # Check if this is the selected model
             model_slug = model.get('slug') or model.get('name') or model.get('short_name', '')
-            if model_slug == model_name:
-                endpoint = model.get('endpoint', {})
-                if endpoint:
-                    api_is_free = endpoint.get('is_free', False)
-                    pricing = endpoint.get('pricing', {})
-                    
-                    # Check if the model name explicitly indicates it's free
-                    is_explicitly_free = model_name and (model_name.endswith(':free') or ':free' in model_name)
+            by_slug[model_slug].append(model)
+        enhanced_models_index['by_slug'] = dict(by_slug)
+        enhanced_models_index['source'] = enhanced_models
+    return enhanced_models_index['by_slug']
+
+def get_model_pricing_info(model_name):
+    """Get pricing information for a specific model"""
+    try:
+        for model in get_enhanced_models_by_slug().get(model_name, ()):
+            endpoint = model.get('endpoint', EMPTY_MAPPING)
+            if endpoint:
+                api_is_free = endpoint.get('is_free', False)
+                pricing = endpoint.get('pricing', EMPTY_MAPPING)
+                
+                # Check if the model name explicitly indicates it's free
+                is_explicitly_free = model_name and (model_name.endswith(':free') or ':free' in model_name)
+                
+                # For explicitly free models, always return free pricing regardless of API data
+                if is_explicitly_free:
+                    return {
+                        'is_free': True,
+                        'prompt_price': 0.0,
+                        'completion_price': 0.0,
+                        'display': 'FREE (OpenRouter)',
+                        'provider': endpoint.get('provider_name', 'Unknown')
+                    }
+                elif pricing:
+                    prompt_price = float(pricing.get('prompt', '0'))
+                    completion_price = float(pricing.get('completion', '0'))
                     
-                    # For explicitly free models, always return free pricing regardless of API data
-                    if is_explicitly_free:
+                    if prompt_price == 0 and completion_price == 0:
+                        # Model has 0 pricing but may still require credits
+                        # Don't trust 0-pricing for non-explicit free models
                         return {
-                            'is_free': True,
+                            'is_free': False,
                             'prompt_price': 0.0,
                             'completion_price': 0.0,
-                            'display': 'FREE (OpenRouter)',
+                            'display': 'Requires credits',
                             'provider': endpoint.get('provider_name', 'Unknown')
                         }
-                    elif pricing:
-                        prompt_price = float(pricing.get('prompt', '0'))
-                        completion_price = float(pricing.get('completion', '0'))
-                        
-                        if prompt_price == 0 and completion_price == 0:
-                            # Model has 0 pricing but may still require credits
-                            # Don't trust 0-pricing for non-explicit free models
-                            return {
-                                'is_free': False,
-                                'prompt_price': 0.0,
-                                'completion_price': 0.0,
-                                'display': 'Requires credits',
-                                'provider': endpoint.get('provider_name', 'Unknown')
-                            }
+                    else:
+                        # Format prices for display
+                        if prompt_price * 1000 < 0.001:
+                            prompt_display = f"${prompt_price * 1000:.4f}"
                         else:
-                            # Format prices for display
-                            if prompt_price * 1000 < 0.001:
-                                prompt_display = f"${prompt_price * 1000:.4f}"
-                            else:
-                                prompt_display = f"${prompt_price * 1000:.3f}"
-                                
-                            if completion_price * 1000 < 0.001:
-                                completion_display = f"${completion_price * 1000:.4f}"
-                            else:
-                                completion_display = f"${completion_price * 1000:.3f}"
-                                
-                            return {
-                                'is_free': False,
-                                'prompt_price': prompt_price,
-                                'completion_price': completion_price,
-                                'display': f"{prompt_display}/1K prompt, {completion_display}/1K completion",
-                                'provider': endpoint.get('provider_name', 'Unknown')
-                            }
-        
+                            prompt_display = f"${prompt_price * 1000:.3f}"
+                            
+                        if completion_price * 1000 < 0.001:
+                            completion_display = f"${completion_price * 1000:.4f}"
+                        else:
+                            completion_display = f"${completion_price * 1000:.3f}"
+                            
+                        return {
+                            'is_free': False,
+                            'prompt_price': prompt_price,
+                            'completion_price': completion_price,
+                            'display': f"{prompt_display}/1K prompt, {completion_display}/1K completion",
+                            'provider': endpoint.get('provider_name', 'Unknown')
+                        }
+    
         # Model not found in enhanced models - check if it's a free model by name
         if model_name and (model_name.endswith(':free') or ':free' in model_name):
             return {
@@ -1432,6 +2206,21 @@ def calculate_session_cost(total_prompt_tokens, total_completion_tokens, pricing
 
 
 
+def read_multiline_input():
+    """Read lines from stdin until two consecutive empty lines (or EOF); blank lines are dropped"""
+    lines = []
+    empty_line_count = 0
+    for line in iter(sys.stdin.readline, ""):
+        line = line.rstrip("\r\n")
+        if not line:
+            empty_line_count += 1
+            if empty_line_count >= 2:  # Exit after two consecutive empty lines
+                break
+        else:
+            empty_line_count = 0  # Reset counter if non-empty line
+            lines.append(line)
+    return lines
+
 def setup_wizard():
     """Interactive setup wizard for first-time users"""
     console.print(Panel.fit(
@@ -1441,8 +2230,10 @@ def setup_wizard():
     ))
 
     if "OPENROUTER_API_KEY" not in os.environ:
-        console.print("[bold yellow]🔐 API Key Setup[/bold yellow]")
-        console.print("[dim]Your API key will be encrypted and stored securely[/dim]")
+        console.print(
+            "[bold yellow]🔐 API Key Setup[/bold yellow]\n"
+            "[dim]Your API key will be encrypted and stored securely[/dim]"
+        )
         
         # Loop until we get a valid API key or user explicitly cancels
         while True:
@@ -1459,26 +2250,28 @@ def setup_wizard():
     else:
         api_key = os.getenv("OPENROUTER_API_KEY")
 
-    # Save API key temporarily to allow model fetching
-    temp_config = {'api_key': api_key, 'thinking_mode': False}  # Default to disabled
-
-    # Use the simplified model selection
-    console.print("[bold]Select an AI model to use:[/bold]")
-    model = ""
-    thinking_mode = False  # Default value - disabled
-    try:
-        with console.status("[bold green]Connecting to OpenRouter...[/bold green]"):
-            # Small delay to ensure the API key is registered
-            time.sleep(1)
-
-        selected_model = select_model(temp_config)
-        if selected_model:
-            model = selected_model
-            # Use the thinking_mode value that was set during model selection
-            thinking_mode = temp_config.get('thinking_mode', False)
-        else:
-            console.print("[yellow]Model selection cancelled. You can set a model later.[/yellow]")
-    except Exception as e:
+    # One config dict is filled in by every step below; select_model sets thinking_mode on it
+    config_data = {
+        'api_key': api_key,
+        'model': "",
+        'temperature': 0.7,
+        'system_instructions': "",
+        'theme': 'default',
+        'max_tokens': 0,
+        'autosave_interval': 300,
+        'streaming': True,
+        'thinking_mode': False  # Default to disabled
+    }
+
+    # Use the simplified model selection
+    console.print("[bold]Select an AI model to use:[/bold]")
+    try:
+        selected_model = select_model(config_data)
+        if selected_model:
+            config_data['model'] = selected_model
+        else:
+            console.print("[yellow]Model selection cancelled. You can set a model later.[/yellow]")
+    except Exception as e:
         console.print(f"[yellow]Error during model selection: {str(e)}. You can set a model later.[/yellow]")
 
     temperature = float(Prompt.ask("Set temperature (0.0-2.0)", default="0.7"))
@@ -1487,38 +2280,29 @@ def setup_wizard():
         confirm = Prompt.ask("Are you sure you want to use this high temperature? (y/n)", default="n")
         if confirm.lower() != 'y':
             temperature = float(Prompt.ask("Enter a new temperature value (0.0-1.0)", default="0.7"))
+    config_data['temperature'] = temperature
 
-    console.print("[bold]Enter system instructions (guide the AI's behavior)[/bold]")
-    console.print("[dim]Press Enter twice to finish[/dim]")
-    lines = []
-    empty_line_count = 0
-    while True:
-        line = input()
-        if not line:
-            empty_line_count += 1
-            if empty_line_count >= 2:  # Exit after two consecutive empty lines
-                break
-        else:
-            empty_line_count = 0  # Reset counter if non-empty line
-            lines.append(line)
+    console.print(
+        "[bold]Enter system instructions (guide the AI's behavior)[/bold]\n"
+        "[dim]Press Enter twice to finish[/dim]"
+    )
+    lines = read_multiline_input()
 
     # If no instructions provided, use a default value
     if not lines:
-        system_instructions = "You are a helpful AI assistant."
+        config_data['system_instructions'] = "You are a helpful AI assistant."
         console.print("[yellow]No system instructions provided. Using default instructions.[/yellow]")
     else:
-        system_instructions = "\n".join(lines)
+        config_data['system_instructions'] = "\n".join(lines)
 
     # Add theme selection
     available_themes = ['default', 'dark', 'light', 'hacker']
-    console.print("[green]Available themes:[/green]")
-    for theme in available_themes:
-        console.print(f"- {theme}")
-    theme_choice = Prompt.ask("Select theme", choices=available_themes, default="default")
+    console.print("[green]Available themes:[/green]\n" + "\n".join(f"- {theme}" for theme in available_themes))
+    config_data['theme'] = Prompt.ask("Select theme", choices=available_themes, default="default")
 
     # We already asked about thinking mode during model selection, so we'll use that value
     # Only ask if model selection failed or was cancelled
-    if not model:
+    if not config_data['model']:
         # Enhanced thinking mode explanation
         console.print(Panel.fit(
             "[yellow]Thinking Mode:[/yellow]\n\n"
@@ -1529,24 +2313,12 @@ def setup_wizard():
             border_style="yellow"
         ))
 
-        thinking_mode = Prompt.ask(
+        config_data['thinking_mode'] = Prompt.ask(
             "Enable thinking mode?",
             choices=["y", "n"],
             default="n"
         ).lower() == "y"
 
-    config_data = {
-        'api_key': api_key,
-        'model': model,
-        'temperature': temperature,
-        'system_instructions': system_instructions,
-        'theme': theme_choice,
-        'max_tokens': 0,
-        'autosave_interval': 300,
-        'streaming': True,
-        'thinking_mode': thinking_mode
-    }
-
     save_config(config_data)
     return config_data
 
@@ -1561,118 +2333,190 @@ def format_time_delta(delta_seconds):
         seconds = delta_seconds % 60
         return f"{minutes}m {seconds:.2f}s"
 
-def format_file_size(size_bytes):
-    """Format file size in a human-readable way"""
-    if size_bytes < 1024:
-        return f"{size_bytes} bytes"
-    elif size_bytes < 1024 * 1024:
-        return f"{size_bytes / 1024:.1f} KB"
-    elif size_bytes < 1024 * 1024 * 1024:
-        return f"{size_bytes / (1024 * 1024):.1f} MB"
-    else:
-        return f"{size_bytes / (1024 * 1024 * 1024):.1f} GB"
+def partial_tag_length(text: str, tag: str) -> int:
+    """Length of the longest suffix of text that could be the start of tag
+
+    The tags contain a single '<', so only the text after the last '<' near the end
+    can be a partial tag; most chunks have none and return without slicing.
+    """
+    tag_start = text.rfind("<", max(len(text) - len(tag) + 1, 0))
+    if tag_start == -1:
+        return 0
+    return len(text) - tag_start if tag.startswith(text[tag_start:]) else 0
+
+DELTA_CONTENT_KEY = b'"content":"'
+
+def extract_delta_content(chunk: bytes):
+    """Slice choices[0].delta.content out of an SSE payload without parsing it fully.
+
+    Returns None whenever the payload isn't a plain single-delta chunk (usage data,
+    errors, null or missing content, several content fields) so the caller falls
+    back to a full JSON parse.
+    """
+    if b'"usage"' in chunk:
+        return None
+    delta_index = chunk.find(b'"delta":')
+    if delta_index == -1:
+        return None
+    start = chunk.find(DELTA_CONTENT_KEY, delta_index)
+    if start == -1 or chunk.find(DELTA_CONTENT_KEY, start + 1) != -1:
+        return None
+    start += len(DELTA_CONTENT_KEY)
+
+    # Find the closing quote, skipping quotes escaped by an odd number of backslashes
+    end = chunk.find(b'"', start)
+    while end != -1:
+        backslashes = 0
+        while chunk[end - 1 - backslashes] == 0x5C:  # '\\'
+            backslashes += 1
+        if backslashes % 2 == 0:
+            break
+        end = chunk.find(b'"', end + 1)
+    if end == -1:
+        return None
+
+    raw = chunk[start:end]
+    try:
+        if b'\\' not in raw:
+            return raw.decode('utf-8')
+        return loads_json(b'"' + raw + b'"')
+    except ValueError:
+        return None
+
+class ThinkingStreamParser:
+    """Split streamed reply text into answer and <thinking> sections as chunks arrive.
+
+    Tags split across chunk boundaries are held back in a small pending buffer, so
+    each chunk is scanned once and nothing is re-parsed after the stream ends. A
+    thinking section that is never closed stays part of the answer, tag included.
+    """
+
+    def __init__(self):
+        self.content_chunks = []
+        self.thinking_sections = []
+        self.current_thinking = None  # chunks of the open thinking section, if any
+        self.pending = ""
+
+    def feed(self, text: str) -> None:
+        if self.current_thinking is None and not self.pending and "<" not in text:
+            # Plain answer text: no tag can start in this chunk
+            self.content_chunks.append(text)
+            return
+
+        buffer = self.pending + text
+        while buffer:
+            if self.current_thinking is None:
+                tag, target = THINKING_OPEN_TAG, self.content_chunks
+            else:
+                tag, target = THINKING_CLOSE_TAG, self.current_thinking
+
+            index = buffer.find(tag)
+            if index == -1:
+                keep = partial_tag_length(buffer, tag)
+                target.append(buffer[:len(buffer) - keep])
+                self.pending = buffer[len(buffer) - keep:]
+                return
+
+            target.append(buffer[:index])
+            buffer = buffer[index + len(tag):]
+            if self.current_thinking is None:
+                self.current_thinking = []
+            else:
+                self.thinking_sections.append("".join(self.current_thinking))
+                self.current_thinking = None
+        self.pending = ""
+
+    def finish(self):
+        """Return (answer, thinking sections) once the stream has ended"""
+        if self.current_thinking is None:
+            self.content_chunks.append(self.pending)
+        else:
+            # Unterminated thinking section: keep it in the answer as the model sent it
+            self.content_chunks.append(THINKING_OPEN_TAG)
+            self.content_chunks.extend(self.current_thinking)
+            self.content_chunks.append(self.pending)
+            self.current_thinking = None
+        self.pending = ""
+        return "".join(self.content_chunks), self.thinking_sections
 
 def stream_response(response, start_time, thinking_mode=False):
-    """Stream the response from the API with proper text formatting"""
+    """Stream the response from the API with proper text formatting
+
+    start_time is the time.monotonic() reading taken when the request was sent.
+    Ctrl+C stops the stream early and keeps the part of the reply received so far;
+    if nothing arrived yet, the KeyboardInterrupt is re-raised.
+    """
+    # rich.markdown pulls in markdown-it; import it on first reply rather than at startup
+    from rich.markdown import Markdown
+
     console.print("\n[bold green]Assistant[/bold green]")
 
-    # Full content accumulates everything
-    full_content = ""
-    # For thinking detection
-    thinking_content = ""
-    in_thinking = False
+    # Reply text is collected as chunks and joined once; in thinking mode the parser
+    # separates <thinking> sections while streaming
+    content_chunks = []
+    thinking_parser = ThinkingStreamParser() if thinking_mode else None
     # For capturing usage information
     usage_info = None
 
-    # Create a temporary file to collect all content
-    # This avoids terminal display issues
-    collected_content = []
-
     # For debugging purposes
     global last_thinking_content
 
+    interrupted = False
     try:
-        for chunk in response.iter_lines():
+        for chunk in iter_response_lines(response):
             if not chunk:
                 continue
 
-            chunk_text = chunk.decode('utf-8', errors='replace')
-
-            if "OPENROUTER PROCESSING" in chunk_text:
+            # SSE lines are parsed as raw bytes; both orjson and json accept UTF-8 input.
+            # Lines starting with ':' are SSE comments, e.g. ": OPENROUTER PROCESSING" keep-alives.
+            if chunk.startswith(b':') or chunk == b"data: [DONE]":
                 continue
 
-            if chunk_text.startswith('data:'):
-                chunk_text = chunk_text[5:].strip()
+            if chunk.startswith(b'data:'):
+                chunk = chunk[5:].strip()
+                if chunk == b"[DONE]":
+                    continue
 
-            if chunk_text == "[DONE]":
-                continue
+            # Most chunks carry only a delta's text, which is sliced out without a full parse
+            content = extract_delta_content(chunk)
+            if content is None:
+                try:
+                    chunk_data = loads_json(chunk)
+                except ValueError:
+                    # For non-JSON or undecodable chunks, quietly ignore
+                    continue
+                if not isinstance(chunk_data, dict):
+                    continue
 
-            try:
-                chunk_data = json.loads(chunk_text)
-                
                 # Capture usage information if present
                 if 'usage' in chunk_data:
                     usage_info = chunk_data['usage']
-                
+
                 if 'choices' in chunk_data and chunk_data['choices']:
-                    delta = chunk_data['choices'][0].get('delta', {})
+                    delta = chunk_data['choices'][0].get('delta') or EMPTY_MAPPING
                     content = delta.get('content', delta.get('text', ''))
 
-                    if content:
-                        # Add to full content
-                        full_content += content
-
-                        # Only process thinking tags if thinking mode is enabled
-                        if thinking_mode:
-                            # Check for thinking tags
-                            if "<thinking>" in content:
-                                in_thinking = True
-                                # Extract content after the tag
-                                thinking_part = content.split("<thinking>", 1)[1]
-                                thinking_content += thinking_part
-                                # Skip this chunk - don't display the <thinking> tag
-                                continue
-
-                            if "</thinking>" in content:
-                                in_thinking = False
-                                # Extract content before the tag
-                                thinking_part = content.split("</thinking>", 1)[0]
-                                thinking_content += thinking_part
-                                # Skip this chunk - don't display the </thinking> tag
-                                continue
-
-                            if in_thinking:
-                                thinking_content += content
-                                continue
-
-                        # Not in thinking mode or model doesn't support thinking, collect for display
-                        collected_content.append(content)
-            except json.JSONDecodeError:
-                # For non-JSON chunks, quietly ignore
-                pass
-    except Exception as e:
+            if content:
+                # Only process thinking tags if thinking mode is enabled
+                if thinking_parser is not None:
+                    thinking_parser.feed(content)
+                else:
+                    content_chunks.append(content)
+    except KeyboardInterrupt:
+        interrupted = True
+    except NETWORK_ERRORS as e:
+        # Dropped connections and read timeouts surface as ChunkedEncodingError/ConnectionError
         console.print(f"\n[red]Error during streaming: {str(e)}[/red]")
+    finally:
+        # Return the connection to the pool even if rendering a chunk failed
+        response.close()
 
-    # More robust thinking extraction - uses regex pattern to look for any thinking tags in the full content
-    thinking_section = ""
-    thinking_pattern = re.compile(r'<thinking>(.*?)</thinking>', re.DOTALL)
-    thinking_matches = thinking_pattern.findall(full_content)
-
-    if thinking_mode and thinking_matches:
-        thinking_section = "\n".join(thinking_matches)
-        # Update the global thinking content variable
-        last_thinking_content = thinking_section
-
-        # Display thinking content immediately if found
-        console.print(Panel.fit(
-            Markdown(last_thinking_content),
-            title="🧠 AI Thinking Process",
-            border_style="yellow"
-        ))
-    else:
-        # Also check if thinking_content has any content from our incremental collection
-        if thinking_content.strip():
-            last_thinking_content = thinking_content
+    if thinking_parser is not None:
+        cleaned_content, thinking_sections = thinking_parser.finish()
+        if thinking_sections:
+            cleaned_content = cleaned_content.strip()
+            # Update the global thinking content variable
+            last_thinking_content = "\n".join(thinking_sections)
 
             # Display thinking content immediately if found
             console.print(Panel.fit(
@@ -1680,20 +2524,11 @@ def stream_response(response, start_time, thinking_mode=False):
                 title="🧠 AI Thinking Process",
                 border_style="yellow"
             ))
+    else:
+        cleaned_content = "".join(content_chunks)
 
-    # Clean the full content - only if model supports thinking
-    cleaned_content = full_content
-    if thinking_mode and "<thinking>" in full_content:
-        # Remove the thinking sections with a more robust pattern
-        try:
-            # Use a non-greedy match to handle multiple thinking sections
-            cleaned_content = re.sub(r'<thinking>.*?</thinking>', '', full_content, flags=re.DOTALL)
-            cleaned_content = cleaned_content.strip()
-        except:
-            # Fallback to simpler method
-            parts = full_content.split("</thinking>")
-            if len(parts) > 1:
-                cleaned_content = parts[-1].strip()
+    if interrupted and not cleaned_content.strip():
+        raise KeyboardInterrupt
 
     # If after cleaning we have nothing, use a default response
     if not cleaned_content.strip():
@@ -1703,8 +2538,10 @@ def stream_response(response, start_time, thinking_mode=False):
         console.print(Markdown(cleaned_content))
     else:
         console.print("Hello! I'm here to help you.")
+    if interrupted:
+        console.print("[yellow]Response interrupted; the partial reply was kept.[/yellow]")
 
-    response_time = time.time() - start_time
+    response_time = time.monotonic() - start_time
     return cleaned_content, response_time, usage_info
 
 def save_conversation(conversation_history, filename, fmt="markdown"):
@@ -1745,42 +2582,217 @@ def save_conversation(conversation_history, filename, fmt="markdown"):
 
     return filename
 
-def manage_context_window(conversation_history, max_tokens=8000, model_name="cl100k_base"):
-    """Manage the context window to prevent exceeding token limits"""
+# Token counts of conversation messages: id(message) -> (content, model name, token count).
+# Holding the content object means an id reused by a new message can't match a stale entry.
+message_token_counts = {}
+
+def count_message_tokens(msg, model_name="cl100k_base"):
+    """Count the tokens of a message, reusing the count while its content is unchanged"""
+    content = msg["content"]
+    cached = message_token_counts.get(id(msg))
+    if cached is not None and cached[0] is content and cached[1] == model_name:
+        return cached[2]
+    if isinstance(content, list):
+        # Multimodal messages: count the text parts; image parts carry no text tokens
+        tokens = sum(count_tokens(part.get("text", ""), model_name) for part in content if part.get("type") == "text")
+    elif msg["role"] == "system":
+        # The system prompt is re-created as a new message by /clear, /new and /system
+        tokens = count_system_prompt_tokens(content, model_name)
+    else:
+        tokens = count_tokens(content, model_name)
+    message_token_counts[id(msg)] = (content, model_name, tokens)
+    return tokens
+
+def count_history_tokens(messages, model_name="cl100k_base"):
+    """Return the token count of each message, tokenizing uncounted messages in one batch
+
+    tiktoken encodes a batch in its Rust core across threads without holding the GIL.
+    """
+    uncounted = []
+    for msg in messages:
+        content = msg["content"]
+        cached = message_token_counts.get(id(msg))
+        if (cached is None or cached[0] is not content or cached[1] != model_name) \
+                and isinstance(content, str) and msg["role"] != "system":
+            uncounted.append(msg)
+
+    if len(uncounted) > 1:
+        encoded = get_token_encoding(model_name).encode_ordinary_batch([msg["content"] for msg in uncounted])
+        for msg, tokens in zip(uncounted, encoded):
+            message_token_counts[id(msg)] = (msg["content"], model_name, len(tokens))
+
+    return [count_message_tokens(msg, model_name) for msg in messages]
+
+@lru_cache(maxsize=8)
+def count_system_prompt_tokens(content, model_name="cl100k_base"):
+    """Count system prompt tokens keyed by the prompt text, so equal prompts are tokenized once"""
+    return count_tokens(content, model_name)
+
+def manage_context_window(conversation_history, max_tokens=8000, model_name="cl100k_base", precomputed_total=None):
+    """Manage the context window to prevent exceeding token limits
+
+    Returns the (possibly trimmed) history, the number of messages removed and the
+    token count of the returned history. precomputed_total is the caller's running
+    token count of the history; when it is within the limit the history is returned
+    without walking it.
+    """
+    if precomputed_total is not None and precomputed_total <= max_tokens:
+        return conversation_history, 0, precomputed_total
+
     # Always keep the system message
     system_message = conversation_history[0]
 
-    # Count total tokens in the conversation
-    total_tokens = sum(count_tokens(msg["content"], model_name) for msg in conversation_history)
+    # Count total tokens in the conversation; only new messages are tokenized
+    token_counts = count_history_tokens(conversation_history, model_name)
+    total_tokens = sum(token_counts)
+
+    # Forget messages that have left the conversation (cleared or trimmed)
+    if len(message_token_counts) > 2 * len(conversation_history):
+        live_ids = {id(msg) for msg in conversation_history}
+        for msg_id in [msg_id for msg_id in message_token_counts if msg_id not in live_ids]:
+            del message_token_counts[msg_id]
 
     # If we're under the limit, no need to trim
     if total_tokens <= max_tokens:
-        return conversation_history, 0
+        return conversation_history, 0, total_tokens
 
-    # We need to trim the conversation
-    # Start with just the system message
-    trimmed_history = [system_message]
-    current_tokens = count_tokens(system_message["content"], model_name)
+    # We need to trim the conversation, starting from the system message's budget
+    current_tokens = token_counts[0]
 
     # Add messages from the end (most recent) until we approach the limit
-    # Leave room for the next user message
-    messages_to_consider = conversation_history[1:]
+    # Leave room for the next user message. Kept messages are collected newest
+    # first and reversed once, instead of inserting each one after the system message.
+    kept_messages = []
     trimmed_count = 0
 
-    for msg in reversed(messages_to_consider):
-        msg_tokens = count_tokens(msg["content"], model_name)
+    for msg, msg_tokens in zip(reversed(conversation_history[1:]), reversed(token_counts[1:])):
         if current_tokens + msg_tokens < max_tokens - 1000:  # Leave 1000 tokens buffer
-            trimmed_history.insert(1, msg)  # Insert after system message
+            kept_messages.append(msg)
             current_tokens += msg_tokens
         else:
             trimmed_count += 1
 
-    # Add a note about trimmed messages if any were removed
-    if trimmed_count > 0:
-        note = {"role": "system", "content": f"Note: {trimmed_count} earlier messages have been removed to stay within the context window."}
-        trimmed_history.insert(1, note)
+    # Only the oldest messages are evicted; the system message and the order of the
+    # rest are untouched so the prompt prefix stays cacheable by the provider. The
+    # note about removed messages is added at request time by build_trim_note.
+    trimmed_history = [system_message]
+    kept_messages.reverse()
+    trimmed_history.extend(kept_messages)
+
+    return trimmed_history, trimmed_count, current_tokens
 
-    return trimmed_history, trimmed_count
+def build_trim_note(removed_count):
+    """Build the system note sent ahead of the history when earlier messages were trimmed"""
+    return {"role": "system", "content": f"Note: {removed_count} earlier messages have been removed to stay within the context window."}
+
+# Prompt caching switch, turned off by the --no-cache command line flag
+prompt_cache = {'enabled': True}
+
+def uses_cache_control(model_name):
+    """Check whether requests for this model should carry explicit prompt cache breakpoints
+
+    OpenRouter passes cache_control through to Anthropic, which caches the prompt
+    up to the marked block; other providers cache stable prefixes automatically.
+    """
+    return prompt_cache['enabled'] and model_name.startswith("anthropic/")
+
+def mark_cache_breakpoint(msg):
+    """Return a copy of an API message whose last content block is marked as a cache breakpoint"""
+    content = msg["content"]
+    if isinstance(content, str) and content:
+        blocks = [{"type": "text", "text": content}]
+    elif isinstance(content, list) and content and isinstance(content[-1], dict):
+        blocks = content[:-1] + [dict(content[-1])]
+    else:
+        return msg
+    blocks[-1]["cache_control"] = {"type": "ephemeral"}
+    return {**msg, "content": blocks}
+
+# Message roles accepted by the OpenRouter API
+API_MESSAGE_ROLES = frozenset({"system", "user", "assistant"})
+
+def clean_api_message(msg, is_gemma):
+    """Copy a history message into the fields the OpenRouter API accepts, or None to skip it"""
+    clean_msg = {
+        "role": msg["role"],
+        "content": msg["content"]
+    }
+    # Handle models that don't support system messages (like Gemma)
+    if clean_msg["role"] == "system":
+        # Check if this is a Gemma model that doesn't support system messages
+        if is_gemma:
+            # Convert system message to user message with instructions
+            if clean_msg["content"] and clean_msg["content"].strip():
+                clean_msg["role"] = "user"
+                clean_msg["content"] = f"Please follow these instructions: {clean_msg['content']}"
+            else:
+                # Skip empty system messages
+                return None
+
+    # Only include valid roles for OpenRouter API
+    if clean_msg["role"] in API_MESSAGE_ROLES:
+        return clean_msg
+    return None
+
+# Encoded API messages: id(message) -> (content, role, model name, is cache breakpoint, JSON bytes or None)
+api_message_cache = {}
+
+def encode_api_messages(messages, model_name, notes=()):
+    """Serialize messages as a JSON array, re-encoding only messages that changed since the last request
+
+    notes holds per-request system notes placed after the leading system message and
+    before the rest of the history, so they never follow the user's latest turn; they
+    are encoded without being cached.
+    """
+    parts = []
+    is_gemma = "gemma" in model_name.lower()
+    # Cache breakpoints go on the leading system message and on the newest history
+    # message, so each request reads the prefix the previous one wrote
+    cache_control = uses_cache_control(model_name)
+    last_index = len(messages) - 1
+    for index, msg in enumerate(messages):
+        content = msg["content"]
+        is_breakpoint = cache_control and (
+            index == last_index or (index == 0 and msg["role"] == "system")
+        )
+        cached = api_message_cache.get(id(msg))
+        if cached is not None and cached[0] is content and cached[1:4] == (msg["role"], model_name, is_breakpoint):
+            encoded = cached[4]
+        else:
+            clean_msg = clean_api_message(msg, is_gemma)
+            if clean_msg is None:
+                encoded = None
+            else:
+                if is_breakpoint:
+                    clean_msg = mark_cache_breakpoint(clean_msg)
+                encoded = dumps_json(clean_msg)
+            api_message_cache[id(msg)] = (content, msg["role"], model_name, is_breakpoint, encoded)
+        if encoded is not None:
+            parts.append(encoded)
+
+        if index == 0 and notes:
+            # The system message keeps its cacheable bytes; the notes follow it
+            for note in notes:
+                clean_msg = clean_api_message(note, is_gemma)
+                if clean_msg is not None:
+                    parts.append(dumps_json(clean_msg))
+
+    # Forget messages that have left the conversation
+    if len(api_message_cache) > 2 * len(messages):
+        live_ids = {id(msg) for msg in messages}
+        for msg_id in [msg_id for msg_id in api_message_cache if msg_id not in live_ids]:
+            del api_message_cache[msg_id]
+
+    return b"[" + b",".join(parts) + b"]"
+
+def encode_chat_request(model_name, messages, temperature, notes=()):
+    """Build the streaming chat completions request body by splicing pre-encoded messages"""
+    return b"".join((
+        b'{"model":', dumps_json(model_name),
+        b',"messages":', encode_api_messages(messages, model_name, notes),
+        b',"temperature":', dumps_json(temperature),
+        b',"stream":true}',
+    ))
 
 def validate_file_security(file_path):
     """Validate file for security concerns before processing"""
@@ -1800,7 +2812,7 @@ def validate_file_security(file_path):
         # Check file extension
         file_ext = os.path.splitext(file_path)[1].lower()
         if file_ext not in ALLOWED_FILE_EXTENSIONS:
-            return False, f"File type '{file_ext}' not allowed. Allowed types: {', '.join(sorted(ALLOWED_FILE_EXTENSIONS))}"
+            return False, f"File type '{file_ext}' not allowed. Allowed types: {ALLOWED_FILE_EXTENSIONS_TEXT}"
         
         # Basic path traversal prevention
         normalized_path = os.path.normpath(file_path)
@@ -1924,6 +2936,56 @@ def handle_attachment(file_path, conversation_history):
         console.print(f"[red]Attachment processing error: {str(e)}[/red]")
         return False, f"Error processing attachment: {str(e)}"
 
+def attach_file_reference(file_path, message, conversation_history, session_history=None):
+    """Preview and attach a file referenced with #, returning the user message to send with it
+
+    When message is empty the user is asked for one. Returns None if the file can't
+    be attached or no message is given, so the chat loop goes back to the prompt.
+    """
+    # Handle relative paths - make them absolute
+    if not os.path.isabs(file_path):
+        file_path = os.path.abspath(file_path)
+
+    # Check if file exists; one stat call also gives the size for the preview
+    try:
+        file_stat = os.stat(file_path)
+    except OSError:
+        console.print(f"[red]File not found: {file_path}[/red]")
+        console.print("[dim]Make sure the file path is correct and the file exists.[/dim]")
+        return None
+
+    # Show attachment preview
+    file_name = os.path.basename(file_path)
+    file_ext = os.path.splitext(file_name)[1].lower()
+    console.print(Panel.fit(
+        f"File: [bold]{file_name}[/bold]\n"
+        f"Type: {file_ext[1:].upper() if file_ext else 'Unknown'}\n"
+        f"Size: {format_file_size(file_stat.st_size)}",
+        title="📎 Attachment Preview",
+        border_style="cyan"
+    ))
+
+    # Process the file attachment
+    success, attachment_message = handle_attachment(file_path, conversation_history)
+    if not success:
+        console.print(f"[red]{attachment_message}[/red]")
+        return None
+    console.print(f"[green]{attachment_message}[/green]")
+
+    if message:
+        return message
+
+    # Continue to get user's actual message about the file
+    console.print("\n[dim]The file has been attached. Now enter your message about this file:[/dim]")
+    if HAS_PROMPT_TOOLKIT:
+        message = get_user_input_with_completion(session_history)
+    else:
+        print("> ", end="")
+        message = input()
+
+    # Skip if no message provided
+    return message if message.strip() else None
+
 def extract_file_content(file_path, file_ext):
     """Extract and format content from different file types"""
     # Determine file type based on extension
@@ -1980,89 +3042,530 @@ def show_about():
         border_style="blue"
     ))
 
+def fetch_latest_version() -> str:
+    """Return the latest release version published on GitHub.
+
+    Raises on network errors and on a non-200 response.
+    """
+    with http_session.get(API_URL, timeout=HTTP_TIMEOUT) as response:
+        if response.status_code != 200:
+            raise ValueError(f"Server returned status code {response.status_code}")
+        data = parse_json_response(response)
+    return data.get('tag_name', 'v0.0.0').lstrip('v')
+
+def is_newer_version(latest_version: str) -> bool:
+    """Check whether latest_version is newer than the running APP_VERSION."""
+    from packaging import version
+    return version.parse(latest_version) > version.parse(APP_VERSION)
+
+def offer_update(latest_version: str, silent: bool) -> None:
+    """Show the update notice and let the user update via pip or open the release page."""
+    console.print(Panel.fit(
+        f"[yellow]A new version of OrChat is available![/yellow]\n"
+        f"Current version: [cyan]{APP_VERSION}[/cyan]\n"
+        f"Latest version: [green]{latest_version}[/green]\n\n"
+        f"Update at: {REPO_URL}/releases",
+        title="📢 Update Available",
+        border_style="yellow"
+    ))
+
+    if silent:
+        update_choice = Prompt.ask("Would you like to update now?", choices=["y", "n"], default="n")
+        if update_choice.lower() == "y":
+            try:
+                console.print("[cyan]Attempting to update via pip...[/cyan]")
+                result = subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", "orchat"], 
+                                      capture_output=True, text=True)
+                if result.returncode == 0:
+                    console.print("[green]Update successful! Please restart OrChat.[/green]")
+                    sys.exit(0)
+                else:
+                    console.print(f"[yellow]Update failed: {result.stderr}[/yellow]")
+                    open_browser = Prompt.ask("Open release page for manual update?", choices=["y", "n"], default="y")
+                    if open_browser.lower() == "y":
+                        webbrowser.open(f"{REPO_URL}/releases")
+            except Exception as e:
+                console.print(f"[yellow]Auto-update failed: {str(e)}[/yellow]")
+                open_browser = Prompt.ask("Open release page for manual update?", choices=["y", "n"], default="y")
+                if open_browser.lower() == "y":
+                    webbrowser.open(f"{REPO_URL}/releases")
+    else:
+        open_browser = Prompt.ask("Open release page in browser?", choices=["y", "n"], default="n")
+        if open_browser.lower() == "y":
+            webbrowser.open(f"{REPO_URL}/releases")
+
 # Add this function to check for updates
 def check_for_updates(silent=False):
     """Check GitHub for newer versions of OrChat"""
     if not silent:
         console.print("[bold cyan]Checking for updates...[/bold cyan]")
     try:
-        with urllib.request.urlopen(API_URL) as response:
-            if response.getcode() == 200:
-                data = json.loads(response.read().decode('utf-8'))
-                latest_version = data.get('tag_name', 'v0.0.0').lstrip('v')
-
-                if version.parse(latest_version) > version.parse(APP_VERSION):
-                    console.print(Panel.fit(
-                        f"[yellow]A new version of OrChat is available![/yellow]\n"
-                        f"Current version: [cyan]{APP_VERSION}[/cyan]\n"
-                        f"Latest version: [green]{latest_version}[/green]\n\n"
-                        f"Update at: {REPO_URL}/releases",
-                        title="📢 Update Available",
-                        border_style="yellow"
-                    ))
-
-                    if silent:
-                        update_choice = Prompt.ask("Would you like to update now?", choices=["y", "n"], default="n")
-                        if update_choice.lower() == "y":
-                            try:
-                                console.print("[cyan]Attempting to update via pip...[/cyan]")
-                                result = subprocess.run([sys.executable, "-m", "pip", "install", "--upgrade", "orchat"], 
-                                                      capture_output=True, text=True)
-                                if result.returncode == 0:
-                                    console.print("[green]Update successful! Please restart OrChat.[/green]")
-                                    sys.exit(0)
-                                else:
-                                    console.print(f"[yellow]Update failed: {result.stderr}[/yellow]")
-                                    open_browser = Prompt.ask("Open release page for manual update?", choices=["y", "n"], default="y")
-                                    if open_browser.lower() == "y":
-                                        webbrowser.open(f"{REPO_URL}/releases")
-                            except Exception as e:
-                                console.print(f"[yellow]Auto-update failed: {str(e)}[/yellow]")
-                                open_browser = Prompt.ask("Open release page for manual update?", choices=["y", "n"], default="y")
-                                if open_browser.lower() == "y":
-                                    webbrowser.open(f"{REPO_URL}/releases")
-                    else:
-                        open_browser = Prompt.ask("Open release page in browser?", choices=["y", "n"], default="n")
-                        if open_browser.lower() == "y":
-                            webbrowser.open(f"{REPO_URL}/releases")
-                    return True  # Update available
-                else:
-                    if not silent:
-                        console.print("[green]You are using the latest version of OrChat![/green]")
-                    return False  # No update available
-            else:
-                if not silent:
-                    console.print("[yellow]Could not check for updates. Server returned status "
-                                f"code {response.getcode()}[/yellow]")
-                return False
+        latest_version = fetch_latest_version()
+        if is_newer_version(latest_version):
+            offer_update(latest_version, silent)
+            return True  # Update available
+        if not silent:
+            console.print("[green]You are using the latest version of OrChat![/green]")
+        return False  # No update available
     except Exception as e:
         if not silent:
             console.print(f"[yellow]Could not check for updates: {str(e)}[/yellow]")
         return False
 
+# Startup update check: the future resolving to the latest release version, until it is announced
+update_check = {'future': None}
+
+def start_update_check() -> None:
+    """Fetch the latest release on a daemon thread so startup never waits on GitHub."""
+    future = Future()
+
+    def run():
+        try:
+            future.set_result(fetch_latest_version())
+        except Exception as e:
+            future.set_exception(e)
+
+    update_check['future'] = future
+    threading.Thread(target=run, daemon=True).start()
+
+def announce_update_if_ready() -> None:
+    """Offer the update found by start_update_check, once it has finished.
+
+    Called from the main thread between prompts so the notice never interleaves
+    with input; failed checks are ignored like the old synchronous one.
+    """
+    future = update_check['future']
+    if future is None or not future.done():
+        return
+    update_check['future'] = None
+    try:
+        latest_version = future.result()
+        update_available = is_newer_version(latest_version)
+    except Exception:
+        return  # Silently ignore update check failures
+    if update_available:
+        offer_update(latest_version, silent=True)
+
+
+
+# ============================================================================
+# CHAT COMMANDS
+# ============================================================================
+
+def build_system_prompt(config):
+    """Return the system prompt: the user's instructions, plus the thinking instruction in thinking mode"""
+    # Use user's thinking mode preference instead of model detection
+    if config['thinking_mode']:
+        return f"{config['system_instructions']}\n\n{THINKING_INSTRUCTION}"
+    return config['system_instructions']
+
+def create_session_dir():
+    """Create a timestamped directory under SESSIONS_DIR for saving the session's files"""
+    session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
+    session_dir = os.path.join(SESSIONS_DIR, session_id)
+    os.makedirs(session_dir, exist_ok=True)
+    return session_dir
+
+@dataclass
+class ChatSession:
+    """Mutable state of a chat session shared by the chat loop and the command handlers"""
+    config: dict
+    conversation_history: list
+    session_dir: str
+    pricing_info: dict
+    session_start_time: float = field(default_factory=time.time)
+    last_autosave: float = field(default_factory=time.time)
+    total_tokens_used: int = 0
+    total_prompt_tokens: int = 0
+    total_completion_tokens: int = 0
+    response_times: list = field(default_factory=list)
+    message_count: int = 0
+    # Messages trimmed from the current conversation, reported in a note before the retained history
+    removed_message_count: int = 0
+    # Running token count of conversation_history, updated as messages are appended.
+    # None means the history was changed some other way and must be recounted.
+    history_token_count: Optional[int] = None
+    # Header pricing line, formatted whenever the pricing changes
+    pricing_display: str = field(init=False, default="")
+
+    def __post_init__(self):
+        self.set_pricing(self.pricing_info)
+
+    def set_pricing(self, pricing_info):
+        """Switch cost tracking and the header to another model's pricing"""
+        self.pricing_info = pricing_info
+        self.pricing_display = format_pricing_display(pricing_info)
+
+def build_help_panel():
+    """Build the /help panel, parsing its markup once"""
+    help_text = "/new - Start a new conversation\n" \
+               "/clear - Clear conversation history\n" \
+               "/cls or /clear-screen - Clear terminal screen\n" \
+               "/save - Save conversation to file\n" \
+               "/settings - Adjust model settings\n" \
+               "/tokens - Show token usage statistics\n" \
+               "/model - Change the AI model\n" \
+               "/temperature <0.0-2.0> - Adjust temperature\n" \
+               "/system - View or change system instructions\n" \
+               "/speed - Show response time statistics\n" \
+               "/theme <theme> - Change the color theme\n" \
+               "/about - Show information about OrChat\n" \
+               "/update - Check for updates\n" \
+               "/thinking - Show last AI thinking process\n" \
+               "/thinking-mode - Toggle thinking mode on/off\n" \
+               "# - Browse and attach files (can be used anywhere in your message)\n" \
+               "[yellow]Press Ctrl+C twice to exit[/yellow]"
+
+    if HAS_PROMPT_TOOLKIT:
+        help_text += "\n\n" + "\n".join((
+            "[dim]💡 Interactive Features:[/dim]",
+            "[dim]• Command auto-completion: Type '/' and all commands appear instantly[/dim]",
+            "[dim]• File picker: Type '#' anywhere to browse and select files[/dim]",
+            "[dim]• Continue typing to filter commands/files (e.g., '/c' or '#main'[/dim]",
+            "[dim]• Press ↑/↓ arrow keys to navigate through previous prompts[/dim]",
+            "[dim]• Press Ctrl+R to search through prompt history[/dim]",
+            "[dim]• Press Esc+Enter to toggle multi-line input mode[/dim]",
+            "[dim]• Auto-suggestions: Previous prompts appear as grey text while typing[/dim]",
+        ))
+
+    return Panel.fit(
+        Text.from_markup(help_text),
+        title="Available Commands"
+    )
+
+# The help text never changes while OrChat runs
+HELP_PANEL = build_help_panel()
+
+# First line of the session header; the same for every session
+SESSION_HEADER_TITLE = Text.assemble(("Or", "bold blue"), ("Chat", "bold green"), " ", (f"v{APP_VERSION}", "dim"))
+
+@lru_cache(maxsize=4)
+def build_session_header(model, temperature, thinking_mode, pricing_display, started_at, exit_hint=False):
+    """Build the "Chat Session Active" panel, reused until the settings it shows change"""
+    # Labels and values sit in a grid, so only the pricing line is parsed as markup
+    fields = Table.grid(padding=(0, 1))
+    fields.add_column(style="cyan")
+    fields.add_column()
+    fields.add_row("Model:", Text(model))
+    fields.add_row("Temperature:", Text(str(temperature)))
+    fields.add_row("Thinking mode:", Text("✓ Enabled", style="green") if thinking_mode else Text("✗ Disabled", style="yellow"))
+    fields.add_row("Pricing:", Text.from_markup(pricing_display))
+    fields.add_row("Session started:", Text(datetime.datetime.fromtimestamp(started_at).strftime('%Y-%m-%d %H:%M:%S')))
+
+    footer = Text("Type your message or use commands: /help for available commands")
+    if exit_hint:
+        footer.append("\nPress Ctrl+C again to exit", style="dim")
+    return Panel.fit(
+        Group(SESSION_HEADER_TITLE, fields, footer),
+        title="🤖 Chat Session Active",
+        border_style="green"
+    )
+
+def format_pricing_display(pricing_info):
+    """Format the pricing value shown in the session header"""
+    pricing_display = pricing_info['display']
+    if pricing_info['is_free']:
+        pricing_display += f" [green]({pricing_info['provider']})[/green]"
+    else:
+        pricing_display += f" [dim]({pricing_info['provider']})[/dim]"
+    return pricing_display
+
+def command_help(session, args):
+    """Show the list of chat commands"""
+    console.print(HELP_PANEL)
+
+def command_clear(session, args):
+    """Clear the conversation history"""
+    session.conversation_history = [{"role": "system", "content": build_system_prompt(session.config)}]
+    session.removed_message_count = 0
+    console.print("[green]Conversation history cleared![/green]")
+
+def command_new(session, args):
+    """Save the current conversation if wanted and start a new one"""
+    # Check if there's any actual conversation to save
+    if len(session.conversation_history) > 1:
+        save_prompt = Prompt.ask(
+            "Would you like to save the current conversation before starting a new one?",
+            choices=["y", "n"],
+            default="n"
+        )
+
+        if save_prompt.lower() == "y":
+            # Auto-generate a filename with timestamp
+            filename = f"conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
+            filepath = os.path.join(session.session_dir, filename)
+            save_conversation(session.conversation_history, filepath, "markdown")
+            console.print(f"[green]Conversation saved to {filepath}[/green]")
+
+    # Reset conversation
+    session.conversation_history = [{"role": "system", "content": build_system_prompt(session.config)}]
+    session.removed_message_count = 0
 
+    # Reset session tracking variables
+    session.total_tokens_used = 0
+    session.response_times = []
+    session.message_count = 0
+    session.last_autosave = time.time()
+
+    # Create a new session directory
+    session.session_dir = create_session_dir()
+
+    console.print(Panel.fit(
+        "[green]New conversation started![/green]\n"
+        "Previous conversation history has been cleared.",
+        title="🔄 New Conversation",
+        border_style="green"
+    ))
+
+def command_save(session, args):
+    """Save the conversation to a file"""
+    if args:
+        filename = args
+    else:
+        filename = Prompt.ask("Enter filename to save conversation",
+                            default=f"conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
+
+    format_options = ["markdown", "json", "html"]
+    format_choice = Prompt.ask("Choose format", choices=format_options, default="markdown")
+
+    if not filename.endswith(f".{format_choice.split('.')[-1]}"):
+        if format_choice == "markdown":
+            filename += ".md"
+        elif format_choice == "json":
+            filename += ".json"
+        elif format_choice == "html":
+            filename += ".html"
+
+    filepath = os.path.join(session.session_dir, filename)
+    save_conversation(session.conversation_history, filepath, format_choice)
+    console.print(f"[green]Conversation saved to {filepath}[/green]")
+
+def command_settings(session, args):
+    """Show the current model settings"""
+    console.print(Panel.fit(
+        f"Current Settings:\n"
+        f"Model: {session.config['model']}\n"
+        f"Temperature: {session.config['temperature']}\n"
+        f"System Instructions: {session.config['system_instructions'][:50]}...",
+        title="Settings"
+    ))
+
+def command_tokens(session, args):
+    """Show token usage and cost statistics for the session"""
+    # Calculate session statistics
+    session_duration = time.time() - session.session_start_time
+    session_cost = calculate_session_cost(session.total_prompt_tokens, session.total_completion_tokens, session.pricing_info)
+
+    # Create detailed token statistics; lines are collected and joined once
+    stats_lines = [
+        "[bold cyan]📊 Session Statistics[/bold cyan]",
+        "",
+        f"[cyan]Model:[/cyan] {session.config['model']}",
+        f"[cyan]Session duration:[/cyan] {format_time_delta(session_duration)}",
+        f"[cyan]Messages exchanged:[/cyan] {session.message_count}",
+        "",
+        "[bold]Token Usage:[/bold]",
+        f"[cyan]Prompt tokens:[/cyan] {session.total_prompt_tokens:,}",
+        f"[cyan]Completion tokens:[/cyan] {session.total_completion_tokens:,}",
+        f"[cyan]Total tokens:[/cyan] {session.total_tokens_used:,}",
+        "[dim]Token counts from OpenRouter API (accurate)[/dim]",
+        "",
+    ]
+
+    if session.pricing_info['is_free']:
+        stats_lines.append("[green]💰 Cost: FREE[/green]")
+    else:
+        if session_cost < 0.01:
+            cost_display = f"${session_cost:.6f}"
+        else:
+            cost_display = f"${session_cost:.4f}"
+        stats_lines.append(f"[cyan]💰 Session cost:[/cyan] {cost_display}")
+        stats_lines.append(f"[dim]{session.pricing_info['display']}[/dim]")
+
+    if session.response_times:
+        avg_time = sum(session.response_times) / len(session.response_times)
+        stats_lines.append("")
+        stats_lines.append(f"[cyan]⏱️ Avg response time:[/cyan] {format_time_delta(avg_time)}")
+
+        if session.total_completion_tokens > 0 and avg_time > 0:
+            tokens_per_second = session.total_completion_tokens / sum(session.response_times)
+            stats_lines.append(f"[cyan]⚡ Speed:[/cyan] {tokens_per_second:.1f} tokens/second")
+
+    console.print(Panel.fit(
+        "\n".join(stats_lines),
+        title="📈 Token Statistics",
+        border_style="cyan"
+    ))
+
+def command_speed(session, args):
+    """Show response time statistics"""
+    if not session.response_times:
+        console.print("[yellow]No response time data available yet.[/yellow]")
+    else:
+        avg_time = sum(session.response_times) / len(session.response_times)
+        min_time = min(session.response_times)
+        max_time = max(session.response_times)
+        console.print(Panel.fit(
+            f"Response Time Statistics:\n"
+            f"Average: {format_time_delta(avg_time)}\n"
+            f"Fastest: {format_time_delta(min_time)}\n"
+            f"Slowest: {format_time_delta(max_time)}\n"
+            f"Total responses: {len(session.response_times)}",
+            title="Speed Statistics"
+        ))
+
+def command_model(session, args):
+    """Change the AI model"""
+    selected_model = select_model(session.config)
+    if selected_model:
+        session.config['model'] = selected_model
+        schedule_config_save(session.config)
+        # Keep cost tracking and the /cls header in step with the new model
+        session.set_pricing(get_model_pricing_info(selected_model))
+        console.print(f"[green]Model changed to {session.config['model']}[/green]")
+    else:
+        console.print("[yellow]Model selection cancelled[/yellow]")
+
+def command_temperature(session, args):
+    """Adjust the sampling temperature"""
+    if args:
+        new_temp = args.split()[0]
+    else:
+        new_temp = Prompt.ask("Enter new temperature (0.0-2.0)", default=str(session.config['temperature']))
+
+    try:
+        temp = float(new_temp)
+    except ValueError:
+        console.print("[red]Invalid temperature value[/red]")
+        return
+
+    if not 0 <= temp <= 2:
+        console.print("[red]Temperature must be between 0 and 2[/red]")
+        return
+
+    if temp > 1.0:
+        console.print("[yellow]Warning: High temperature values (>1.0) may cause erratic or nonsensical responses.[/yellow]")
+        confirm = Prompt.ask("Are you sure you want to use this high temperature? (y/n)", default="n")
+        if confirm.lower() != 'y':
+            return
+
+    session.config['temperature'] = temp
+    schedule_config_save(session.config)
+    console.print(f"[green]Temperature set to {temp}[/green]")
+
+def command_system(session, args):
+    """View or change the system instructions"""
+    if args:
+        session.config['system_instructions'] = args
+        session.conversation_history[0] = {"role": "system", "content": build_system_prompt(session.config)}
+        schedule_config_save(session.config)
+        console.print("[green]System instructions updated![/green]")
+    else:
+        console.print(Panel(session.config['system_instructions'], title="Current System Instructions"))
+        change = Prompt.ask("Update system instructions? (y/n)", default="n")
+        if change.lower() == 'y':
+            console.print("[bold]Enter new system instructions (guide the AI's behavior)[/bold]")
+            console.print("[dim]Press Enter twice to finish[/dim]")
+            system_instructions = "\n".join(read_multiline_input())
+            session.config['system_instructions'] = system_instructions
+            session.conversation_history[0] = {"role": "system", "content": build_system_prompt(session.config)}
+            schedule_config_save(session.config)
+            console.print("[green]System instructions updated![/green]")
+
+def command_theme(session, args):
+    """Change the color theme"""
+    available_themes = ['default', 'dark', 'light', 'hacker']
+
+    if args:
+        theme = args.split()[0].lower()
+        if theme in available_themes:
+            session.config['theme'] = theme
+            schedule_config_save(session.config)
+            console.print(f"[green]Theme changed to {theme}[/green]")
+        else:
+            console.print(f"[red]Invalid theme. Available themes: {', '.join(available_themes)}[/red]")
+    else:
+        console.print(f"[cyan]Current theme:[/cyan] {session.config['theme']}")
+        console.print(f"[cyan]Available themes:[/cyan] {', '.join(available_themes)}")
+        new_theme = Prompt.ask("Select theme", choices=available_themes, default=session.config['theme'])
+        session.config['theme'] = new_theme
+        schedule_config_save(session.config)
+        console.print(f"[green]Theme changed to {new_theme}[/green]")
+
+def command_about(session, args):
+    """Show information about OrChat"""
+    show_about()
+
+def command_update(session, args):
+    """Check for updates"""
+    check_for_updates(silent=False)
+
+def command_thinking(session, args):
+    """Show the last AI thinking process"""
+    if last_thinking_content:
+        console.print(Panel.fit(
+            last_thinking_content,
+            title="🧠 Last Thinking Process",
+            border_style="yellow"
+        ))
+    else:
+        console.print("[yellow]No thinking content available from the last response.[/yellow]")
+
+def command_thinking_mode(session, args):
+    """Toggle thinking mode on/off"""
+    # Toggle thinking mode
+    session.config['thinking_mode'] = not session.config['thinking_mode']
+    schedule_config_save(session.config)
+
+    # Update the system prompt for future messages
+    if len(session.conversation_history) > 0 and session.conversation_history[0]['role'] == 'system':
+        session.conversation_history[0]['content'] = build_system_prompt(session.config)
+
+    console.print(f"[green]Thinking mode is now {'enabled' if session.config['thinking_mode'] else 'disabled'}[/green]")
+
+def command_clear_screen(session, args):
+    """Clear the terminal and redisplay the session header"""
+    # Clear the terminal
+    clear_terminal()
+
+    # After clearing, redisplay the session header for context
+    # Pricing is looked up when the session starts and when /model changes the model
+    console.print(build_session_header(
+        session.config['model'], session.config['temperature'], session.config['thinking_mode'],
+        session.pricing_display, session.session_start_time
+    ))
+    console.print("[green]Terminal screen cleared. Chat session continues.[/green]")
+
+# Chat commands by their first word, each called with the session and the text after it;
+# /cls and /clear-screen are aliases
+CHAT_COMMANDS = {
+    '/help': command_help,
+    '/clear': command_clear,
+    '/new': command_new,
+    '/save': command_save,
+    '/settings': command_settings,
+    '/tokens': command_tokens,
+    '/speed': command_speed,
+    '/model': command_model,
+    '/temperature': command_temperature,
+    '/system': command_system,
+    '/theme': command_theme,
+    '/about': command_about,
+    '/update': command_update,
+    '/thinking': command_thinking,
+    '/thinking-mode': command_thinking_mode,
+    '/cls': command_clear_screen,
+    '/clear-screen': command_clear_screen,
+}
 
 def chat_with_model(config, conversation_history=None):
     """ Main chat loop with model interaction """
-    if conversation_history is None:
-        # Use user's thinking mode preference instead of model detection
-        if config['thinking_mode']:
-            # Make the thinking instruction more explicit and mandatory
-            thinking_instruction = (
-                f"{config['system_instructions']}\n\n"
-                "CRITICAL INSTRUCTION: For EVERY response without exception, you MUST first explain your "
-                "thinking process between <thinking> and </thinking> tags, even for simple greetings or short "
-                "responses. This thinking section should explain your reasoning and approach. "
-                "After the thinking section, provide your final response. Example format:\n"
-                "<thinking>Here I analyze what to say, considering context and appropriate responses...</thinking>\n"
-                "This is my actual response to the user."
-            )
-        else:
-            # Use standard instructions without thinking tags
-            thinking_instruction = config['system_instructions']
+    # Load the tokenizer while the session header and pricing are being fetched
+    threading.Thread(target=get_token_encoding, args=(config['model'],), daemon=True).start()
 
+    if conversation_history is None:
         conversation_history = [
-            {"role": "system", "content": thinking_instruction}
+            {"role": "system", "content": build_system_prompt(config)}
         ]
 
     # Initialize command history for session
@@ -2078,11 +3581,15 @@ def chat_with_model(config, conversation_history=None):
     headers = {
         "Authorization": f"Bearer {config['api_key']}",
         "Content-Type": "application/json",
+        "Accept": "text/event-stream",
     }
 
+    # Session panels are collected and rendered with a single print
+    session_panels = []
+
     # Check if temperature is too high and warn the user
     if config['temperature'] > 1.0:
-        console.print(Panel.fit(
+        session_panels.append(Panel.fit(
             f"[yellow]Warning: High temperature setting ({config['temperature']}) may cause erratic responses.[/yellow]\n"
             f"Consider using a value between 0.0 and 1.0 for more coherent outputs.",
             title="⚠️ High Temperature Warning",
@@ -2091,32 +3598,16 @@ def chat_with_model(config, conversation_history=None):
 
     # Get pricing information for the model
     pricing_info = get_model_pricing_info(config['model'])
-    pricing_display = f"[cyan]Pricing:[/cyan] {pricing_info['display']}"
-    if pricing_info['is_free']:
-        pricing_display += f" [green]({pricing_info['provider']})[/green]"
-    else:
-        pricing_display += f" [dim]({pricing_info['provider']})[/dim]"
-
-    console.print(Panel.fit(
-        f"[bold blue]Or[/bold blue][bold green]Chat[/bold green] [dim]v{APP_VERSION}[/dim]\n"
-        f"[cyan]Model:[/cyan] {config['model']}\n"
-        f"[cyan]Temperature:[/cyan] {config['temperature']}\n"
-        f"[cyan]Thinking mode:[/cyan] {'[green]✓ Enabled[/green]' if config['thinking_mode'] else '[yellow]✗ Disabled[/yellow]'}\n"
-        f"{pricing_display}\n"
-        f"[cyan]Session started:[/cyan] {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-        f"Type your message or use commands: /help for available commands\n"
-        f"[dim]Press Ctrl+C again to exit[/dim]",
-        title="🤖 Chat Session Active",
-        border_style="green"
-    ))
 
     # Add session tracking
     session_start_time = time.time()
-    total_tokens_used = 0
-    total_prompt_tokens = 0
-    total_completion_tokens = 0
-    response_times = []
-    message_count = 0
+
+    session_panels.append(build_session_header(
+        config['model'], config['temperature'], config['thinking_mode'],
+        format_pricing_display(pricing_info), session_start_time, exit_hint=True
+    ))
+    console.print(Group(*session_panels))
+
     max_tokens = config.get('max_tokens')
     
     if not max_tokens or max_tokens == 0:
@@ -2131,21 +3622,34 @@ def chat_with_model(config, conversation_history=None):
         console.print(f"[dim]Using user-defined max tokens: {max_tokens:,}[/dim]")
 
     # Create a session directory for saving files
-    session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-    session_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions", session_id)
-    os.makedirs(session_dir, exist_ok=True)
+    session_dir = create_session_dir()
 
     # Auto-save conversation periodically
-    last_autosave = time.time()
     autosave_interval = config['autosave_interval']
 
     # Check if we need to trim the conversation history
-    conversation_history, trimmed_count = manage_context_window(conversation_history, max_tokens=max_tokens, model_name=config['model'])
+    conversation_history, trimmed_count, history_token_count = manage_context_window(
+        conversation_history, max_tokens=max_tokens, model_name=config['model']
+    )
     if trimmed_count > 0:
         console.print(f"[yellow]Note: Removed {trimmed_count} earlier messages to stay within the context window.[/yellow]")
 
+    # State shared with the command handlers
+    session = ChatSession(
+        config=config,
+        conversation_history=conversation_history,
+        session_dir=session_dir,
+        pricing_info=pricing_info,
+        session_start_time=session_start_time,
+        removed_message_count=trimmed_count,
+        history_token_count=history_token_count,
+    )
+
     while True:
         try:
+            # Offer an update found by the startup check while no input is being read
+            announce_update_if_ready()
+
             # Display user input panel similar to assistant style
             console.print("\n")
             console.print(Panel.fit(
@@ -2169,10 +3673,14 @@ def chat_with_model(config, conversation_history=None):
             ctrl_c_count = 0
 
             # Handle special commands and file picker
+            # Commands and attachments may rewrite the history or switch models
+            if user_input.startswith('/') or '#' in user_input:
+                session.history_token_count = None
+
             # Check if input starts with a command OR contains file picker
             if user_input.startswith('/'):
-                # Handle regular commands starting with /
-                command = user_input.lower()
+                # Regular commands starting with / are dispatched below
+                pass
             elif user_input.startswith('#'):
                 # Handle file picker with #
                 file_path = user_input[1:].strip()
@@ -2181,481 +3689,48 @@ def chat_with_model(config, conversation_history=None):
                     console.print("[yellow]Please select a file using the file picker.[/yellow]")
                     console.print("[dim]Type # to browse files in the current directory[/dim]")
                     continue
-                
-                # Handle relative paths - make them absolute
-                if not os.path.isabs(file_path):
-                    file_path = os.path.abspath(file_path)
-                
-                # Check if file exists
-                if not os.path.exists(file_path):
-                    console.print(f"[red]File not found: {file_path}[/red]")
-                    console.print("[dim]Make sure the file path is correct and the file exists.[/dim]")
-                    continue
 
-                # Show attachment preview
-                file_name = os.path.basename(file_path)
-                file_ext = os.path.splitext(file_path)[1].lower()
-                file_size = os.path.getsize(file_path)
-                file_size_formatted = format_file_size(file_size)
-
-                console.print(Panel.fit(
-                    f"File: [bold]{file_name}[/bold]\n"
-                    f"Type: {file_ext[1:].upper() if file_ext else 'Unknown'}\n"
-                    f"Size: {file_size_formatted}",
-                    title="📎 Attachment Preview",
-                    border_style="cyan"
-                ))
-
-                # Process the file attachment
-                success, message = handle_attachment(file_path, conversation_history)
-                if success:
-                    console.print(f"[green]{message}[/green]")
-                else:
-                    console.print(f"[red]{message}[/red]")
+                user_input = attach_file_reference(file_path, "", session.conversation_history, session_history)
+                if user_input is None:
                     continue
-                
-                # Continue to get user's actual message about the file
-                console.print("\n[dim]The file has been attached. Now enter your message about this file:[/dim]")
-                
-                # Get user input for the message about the file
-                if HAS_PROMPT_TOOLKIT:
-                    user_message = get_user_input_with_completion(session_history)
-                else:
-                    print("> ", end="")
-                    user_message = input()
-                
-                if user_message.strip():
-                    user_input = user_message  # Use the message as the actual input
-                else:
-                    continue  # Skip if no message provided
             
             elif '#' in user_input:
                 # Handle file picker anywhere in the message
-                parts = user_input.split('#', 1)
-                if len(parts) == 2:
-                    message_part = parts[0].strip()
-                    file_and_rest = parts[1].strip()
-                    
-                    if file_and_rest:
-                        # Parse filename and any additional text after it
-                        # Split by whitespace to separate filename from additional text
-                        file_tokens = file_and_rest.split()
-                        file_part = file_tokens[0] if file_tokens else ""
-                        additional_text = " ".join(file_tokens[1:]) if len(file_tokens) > 1 else ""
-                        
-                        if file_part:
-                            # Handle relative paths - make them absolute
-                            if not os.path.isabs(file_part):
-                                file_part = os.path.abspath(file_part)
-                            
-                            # Check if file exists
-                            if not os.path.exists(file_part):
-                                console.print(f"[red]File not found: {file_part}[/red]")
-                                console.print("[dim]Make sure the file path is correct and the file exists.[/dim]")
-                                continue
-
-                        # Show attachment preview
-                        file_name = os.path.basename(file_part)
-                        file_ext = os.path.splitext(file_part)[1].lower()
-                        file_size = os.path.getsize(file_part)
-                        file_size_formatted = format_file_size(file_size)
-
-                        console.print(Panel.fit(
-                            f"File: [bold]{file_name}[/bold]\n"
-                            f"Type: {file_ext[1:].upper() if file_ext else 'Unknown'}\n"
-                            f"Size: {file_size_formatted}",
-                            title="📎 Attachment Preview",
-                            border_style="cyan"
-                        ))
-
-                        # Process the file attachment
-                        success, attachment_message = handle_attachment(file_part, conversation_history)
-                        if success:
-                            console.print(f"[green]{attachment_message}[/green]")
-                            # Combine message part with any additional text after filename
-                            combined_message = ""
-                            if message_part:
-                                combined_message = message_part
-                            if additional_text:
-                                if combined_message:
-                                    combined_message += " " + additional_text
-                                else:
-                                    combined_message = additional_text
-                            
-                            if combined_message:
-                                user_input = combined_message
-                            else:
-                                console.print("\n[dim]File attached. Enter your message about this file:[/dim]")
-                                if HAS_PROMPT_TOOLKIT:
-                                    user_input = get_user_input_with_completion(session_history)
-                                else:
-                                    print("> ", end="")
-                                    user_input = input()
-                        else:
-                            console.print(f"[red]{attachment_message}[/red]")
-                            continue
+                message_part, file_and_rest = (part.strip() for part in user_input.split('#', 1))
+                if file_and_rest:
+                    # Split by whitespace to separate the filename from any additional text after it
+                    file_part, *additional_text = file_and_rest.split(maxsplit=1)
+                    # Combine message part with any additional text after filename
+                    combined_message = " ".join([message_part, *additional_text]).strip()
+
+                    user_input = attach_file_reference(file_part, combined_message, session.conversation_history, session_history)
+                    if user_input is None:
+                        continue
             
             # Process commands if we have one
             if user_input.startswith('/'):
-                command = user_input.lower()
-
-                if command == '/help':
-                    help_text = "/new - Start a new conversation\n" \
-                               "/clear - Clear conversation history\n" \
-                               "/cls or /clear-screen - Clear terminal screen\n" \
-                               "/save - Save conversation to file\n" \
-                               "/settings - Adjust model settings\n" \
-                               "/tokens - Show token usage statistics\n" \
-                               "/model - Change the AI model\n" \
-                               "/temperature <0.0-2.0> - Adjust temperature\n" \
-                               "/system - View or change system instructions\n" \
-                               "/speed - Show response time statistics\n" \
-                               "/theme <theme> - Change the color theme\n" \
-                               "/about - Show information about OrChat\n" \
-                               "/update - Check for updates\n" \
-                               "/thinking - Show last AI thinking process\n" \
-                               "/thinking-mode - Toggle thinking mode on/off\n" \
-                               "# - Browse and attach files (can be used anywhere in your message)\n" \
-                               "[yellow]Press Ctrl+C twice to exit[/yellow]"
-                    
-                    if HAS_PROMPT_TOOLKIT:
-                        help_text += "\n\n[dim]💡 Interactive Features:[/dim]\n"
-                        help_text += "[dim]• Command auto-completion: Type '/' and all commands appear instantly[/dim]\n"
-                        help_text += "[dim]• File picker: Type '#' anywhere to browse and select files[/dim]\n"
-                        help_text += "[dim]• Continue typing to filter commands/files (e.g., '/c' or '#main'[/dim]\n"
-                        help_text += "[dim]• Press ↑/↓ arrow keys to navigate through previous prompts[/dim]\n"
-                        help_text += "[dim]• Press Ctrl+R to search through prompt history[/dim]\n"
-                        help_text += "[dim]• Press Esc+Enter to toggle multi-line input mode[/dim]\n"
-                        help_text += "[dim]• Auto-suggestions: Previous prompts appear as grey text while typing[/dim]"
-                    
-                    console.print(Panel.fit(
-                        help_text,
-                        title="Available Commands"
-                    ))
-                    continue
-
-                elif command == '/clear':
-                    conversation_history = [{"role": "system", "content": config['system_instructions']}]
-                    console.print("[green]Conversation history cleared![/green]")
-                    continue
-
-                elif command == '/new':
-                    # Check if there's any actual conversation to save
-                    if len(conversation_history) > 1:
-                        save_prompt = Prompt.ask(
-                            "Would you like to save the current conversation before starting a new one?",
-                            choices=["y", "n"],
-                            default="n"
-                        )
-
-                        if save_prompt.lower() == "y":
-                            # Auto-generate a filename with timestamp
-                            filename = f"conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md"
-                            filepath = os.path.join(session_dir, filename)
-                            save_conversation(conversation_history, filepath, "markdown")
-                            console.print(f"[green]Conversation saved to {filepath}[/green]")
-
-                    # Reset conversation
-                    conversation_history = [{"role": "system", "content": config['system_instructions']}]
-
-                    # Reset session tracking variables
-                    total_tokens_used = 0
-                    response_times = []
-                    message_count = 0
-                    last_autosave = time.time()
-
-                    # Create a new session directory
-                    session_id = datetime.datetime.now().strftime("%Y%m%d_%H%M%S")
-                    session_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sessions", session_id)
-                    os.makedirs(session_dir, exist_ok=True)
-
-                    console.print(Panel.fit(
-                        "[green]New conversation started![/green]\n"
-                        "Previous conversation history has been cleared.",
-                        title="🔄 New Conversation",
-                        border_style="green"
-                    ))
-                    continue
-
-                elif command == '/save':
-                    parts = user_input.split(' ', 1)
-                    if len(parts) > 1:
-                        filename = parts[1]
-                    else:
-                        filename = Prompt.ask("Enter filename to save conversation",
-                                            default=f"conversation_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.md")
-
-                    format_options = ["markdown", "json", "html"]
-                    format_choice = Prompt.ask("Choose format", choices=format_options, default="markdown")
-
-                    if not filename.endswith(f".{format_choice.split('.')[-1]}"):
-                        if format_choice == "markdown":
-                            filename += ".md"
-                        elif format_choice == "json":
-                            filename += ".json"
-                        elif format_choice == "html":
-                            filename += ".html"
-
-                    filepath = os.path.join(session_dir, filename)
-                    save_conversation(conversation_history, filepath, format_choice)
-                    console.print(f"[green]Conversation saved to {filepath}[/green]")
-                    continue
+                # Split once into the command name and its (case-preserving) arguments
+                command, *args = user_input.split(maxsplit=1)
 
-                elif command == '/settings':
-                    console.print(Panel.fit(
-                        f"Current Settings:\n"
-                        f"Model: {config['model']}\n"
-                        f"Temperature: {config['temperature']}\n"
-                        f"System Instructions: {config['system_instructions'][:50]}...",
-                        title="Settings"
-                    ))
-                    continue
-
-                elif command == '/tokens':
-                    # Calculate session statistics
-                    session_duration = time.time() - session_start_time
-                    session_cost = calculate_session_cost(total_prompt_tokens, total_completion_tokens, pricing_info)
-                    
-                    # Create detailed token statistics
-                    stats_text = f"[bold cyan]📊 Session Statistics[/bold cyan]\n\n"
-                    stats_text += f"[cyan]Model:[/cyan] {config['model']}\n"
-                    stats_text += f"[cyan]Session duration:[/cyan] {format_time_delta(session_duration)}\n"
-                    stats_text += f"[cyan]Messages exchanged:[/cyan] {message_count}\n\n"
-                    
-                    stats_text += f"[bold]Token Usage:[/bold]\n"
-                    stats_text += f"[cyan]Prompt tokens:[/cyan] {total_prompt_tokens:,}\n"
-                    stats_text += f"[cyan]Completion tokens:[/cyan] {total_completion_tokens:,}\n"
-                    stats_text += f"[cyan]Total tokens:[/cyan] {total_tokens_used:,}\n"
-                    stats_text += f"[dim]Token counts from OpenRouter API (accurate)[/dim]\n\n"
-                    
-                    if pricing_info['is_free']:
-                        stats_text += f"[green]💰 Cost: FREE[/green]\n"
-                    else:
-                        if session_cost < 0.01:
-                            cost_display = f"${session_cost:.6f}"
-                        else:
-                            cost_display = f"${session_cost:.4f}"
-                        stats_text += f"[cyan]💰 Session cost:[/cyan] {cost_display}\n"
-                        stats_text += f"[dim]{pricing_info['display']}[/dim]\n"
-                    
-                    if response_times:
-                        avg_time = sum(response_times) / len(response_times)
-                        stats_text += f"\n[cyan]⏱️ Avg response time:[/cyan] {format_time_delta(avg_time)}"
-                        
-                        if total_completion_tokens > 0 and avg_time > 0:
-                            tokens_per_second = total_completion_tokens / sum(response_times)
-                            stats_text += f"\n[cyan]⚡ Speed:[/cyan] {tokens_per_second:.1f} tokens/second"
-                    
-                    console.print(Panel.fit(
-                        stats_text,
-                        title="📈 Token Statistics",
-                        border_style="cyan"
-                    ))
-                    continue
-
-                elif command == '/speed':
-                    if not response_times:
-                        console.print("[yellow]No response time data available yet.[/yellow]")
-                    else:
-                        avg_time = sum(response_times) / len(response_times)
-                        min_time = min(response_times)
-                        max_time = max(response_times)
-                        console.print(Panel.fit(
-                            f"Response Time Statistics:\n"
-                            f"Average: {format_time_delta(avg_time)}\n"
-                            f"Fastest: {format_time_delta(min_time)}\n"
-                            f"Slowest: {format_time_delta(max_time)}\n"
-                            f"Total responses: {len(response_times)}",
-                            title="Speed Statistics"
-                        ))
-                    continue
-
-                elif command.startswith('/model'):
-                    selected_model = select_model(config)
-                    if selected_model:
-                        config['model'] = selected_model
-                        save_config(config)
-                        console.print(f"[green]Model changed to {config['model']}[/green]")
-                    else:
-                        console.print("[yellow]Model selection cancelled[/yellow]")
-                    continue
-
-                elif command.startswith('/temperature'):
-                    parts = command.split()
-                    if len(parts) > 1:
-                        try:
-                            temp = float(parts[1])
-                            if 0 <= temp <= 2:
-                                if temp > 1.0:
-                                    console.print("[yellow]Warning: High temperature values (>1.0) may cause erratic or nonsensical responses.[/yellow]")
-                                    confirm = Prompt.ask("Are you sure you want to use this high temperature? (y/n)", default="n")
-                                    if confirm.lower() != 'y':
-                                        continue
-
-                                config['temperature'] = temp
-                                save_config(config)
-                                console.print(f"[green]Temperature set to {temp}[/green]")
-                            else:
-                                console.print("[red]Temperature must be between 0 and 2[/red]")
-                        except ValueError:
-                            console.print("[red]Invalid temperature value[/red]")
-                    else:
-                        new_temp = Prompt.ask("Enter new temperature (0.0-2.0)", default=str(config['temperature']))
-                        try:
-                            temp = float(new_temp)
-                            if 0 <= temp <= 2:
-                                if temp > 1.0:
-                                    console.print("[yellow]Warning: High temperature values (>1.0) may cause erratic or nonsensical responses.[/yellow]")
-                                    confirm = Prompt.ask("Are you sure you want to use this high temperature? (y/n)", default="n")
-                                    if confirm.lower() != 'y':
-                                        continue
-
-                                config['temperature'] = temp
-                                save_config(config)
-                                console.print(f"[green]Temperature set to {temp}[/green]")
-                            else:
-                                console.print("[red]Temperature must be between 0 and 2[/red]")
-                        except ValueError:
-                            console.print("[red]Invalid temperature value[/red]")
-                    continue
-
-                elif command.startswith('/system'):
-                    parts = user_input.split(' ', 1)
-                    if len(parts) > 1:
-                        config['system_instructions'] = parts[1]
-                        conversation_history[0] = {"role": "system", "content": config['system_instructions']}
-                        save_config(config)
-                        console.print("[green]System instructions updated![/green]")
-                    else:
-                        console.print(Panel(config['system_instructions'], title="Current System Instructions"))
-                        change = Prompt.ask("Update system instructions? (y/n)", default="n")
-                        if change.lower() == 'y':
-                            console.print("[bold]Enter new system instructions (guide the AI's behavior)[/bold]")
-                            console.print("[dim]Press Enter twice to finish[/dim]")
-                            lines = []
-                            empty_line_count = 0
-                            while True:
-                                line = input()
-                                if not line:
-                                    empty_line_count += 1
-                                    if empty_line_count >= 2:  # Exit after two consecutive empty lines
-                                        break
-                                else:
-                                    empty_line_count = 0  # Reset counter if non-empty line
-                                    lines.append(line)
-                            system_instructions = "\n".join(lines)
-                            config['system_instructions'] = system_instructions
-                            conversation_history[0] = {"role": "system", "content": config['system_instructions']}
-                            save_config(config)
-                            console.print("[green]System instructions updated![/green]")
-                    continue
-
-                elif command.startswith('/theme'):
-                    parts = command.split()
-                    available_themes = ['default', 'dark', 'light', 'hacker']
-                    
-                    if len(parts) > 1:
-                        theme = parts[1].lower()
-                        if theme in available_themes:
-                            config['theme'] = theme
-                            save_config(config)
-                            console.print(f"[green]Theme changed to {theme}[/green]")
-                        else:
-                            console.print(f"[red]Invalid theme. Available themes: {', '.join(available_themes)}[/red]")
-                    else:
-                        console.print(f"[cyan]Current theme:[/cyan] {config['theme']}")
-                        console.print(f"[cyan]Available themes:[/cyan] {', '.join(available_themes)}")
-                        new_theme = Prompt.ask("Select theme", choices=available_themes, default=config['theme'])
-                        config['theme'] = new_theme
-                        save_config(config)
-                        console.print(f"[green]Theme changed to {new_theme}[/green]")
-                    continue
-
-                elif command == '/about':
-                    show_about()
-                    continue
-
-                elif command == '/update':
-                    check_for_updates(silent=False)
-                    continue
-
-                elif command == '/thinking':
-                    if last_thinking_content:
-                        console.print(Panel.fit(
-                            last_thinking_content,
-                            title="🧠 Last Thinking Process",
-                            border_style="yellow"
-                        ))
-                    else:
-                        console.print("[yellow]No thinking content available from the last response.[/yellow]")
-                    continue
-
-                elif command == '/thinking-mode':
-                    # Toggle thinking mode
-                    config['thinking_mode'] = not config['thinking_mode']
-                    save_config(config)
-
-                    # Update the system prompt for future messages
-                    if len(conversation_history) > 0 and conversation_history[0]['role'] == 'system':
-                        original_instructions = config['system_instructions']
-                        if config['thinking_mode']:
-                            thinking_instruction = (
-                                f"{original_instructions}\n\n"
-                                "CRITICAL INSTRUCTION: For EVERY response without exception, you MUST first explain your "
-                                "thinking process between <thinking> and </thinking> tags, even for simple greetings or short "
-                                "responses. This thinking section should explain your reasoning and approach. "
-                                "After the thinking section, provide your final response. Example format:\n"
-                                "<thinking>Here I analyze what to say, considering context and appropriate responses...</thinking>\n"
-                                "This is my actual response to the user."
-                            )
-                            conversation_history[0]['content'] = thinking_instruction
-                        else:
-                            # Revert to original instructions without thinking tags
-                            conversation_history[0]['content'] = original_instructions
-
-                    console.print(f"[green]Thinking mode is now {'enabled' if config['thinking_mode'] else 'disabled'}[/green]")
-                    continue
-
-                elif command in ('/cls', '/clear-screen'):
-
-                    # Clear the terminal
-                    clear_terminal()
-
-                    # After clearing, redisplay the session header for context
-                    # Re-get pricing info for display
-                    current_pricing_info = get_model_pricing_info(config['model'])
-                    pricing_display = f"[cyan]Pricing:[/cyan] {current_pricing_info['display']}"
-                    if not current_pricing_info['is_free']:
-                        pricing_display += f" [dim]({current_pricing_info['provider']})[/dim]"
-                    else:
-                        pricing_display += f" [green]({current_pricing_info['provider']})[/green]"
-                        
-                    console.print(Panel.fit(
-                        f"[bold blue]Or[/bold blue][bold green]Chat[/bold green] [dim]v{APP_VERSION}[/dim]\n"
-                        f"[cyan]Model:[/cyan] {config['model']}\n"
-                        f"[cyan]Temperature:[/cyan] {config['temperature']}\n"
-                        f"[cyan]Thinking mode:[/cyan] {'[green]✓ Enabled[/green]' if config['thinking_mode'] else '[yellow]✗ Disabled[/yellow]'}\n"
-                        f"{pricing_display}\n"
-                        f"[cyan]Session started:[/cyan] {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
-                        f"Type your message or use commands: /help for available commands",
-                        title="🤖 Chat Session Active",
-                        border_style="green"
-                    ))
-                    console.print("[green]Terminal screen cleared. Chat session continues.[/green]")
-                    continue
-
-                else:
+                handler = CHAT_COMMANDS.get(command.lower())
+                if handler is None:
                     console.print("[yellow]Unknown command. Type /help for available commands.[/yellow]")
-                    continue
+                else:
+                    handler(session, args[0] if args else "")
+                continue
 
             # Count tokens in user input
             # Estimate input tokens for display purposes (will be replaced by API data if available)
             estimated_input_tokens = count_tokens(user_input)
             input_tokens = estimated_input_tokens
-            total_prompt_tokens += input_tokens
+            session.total_prompt_tokens += input_tokens
 
             # Add user message to conversation history
-            conversation_history.append({"role": "user", "content": user_input})
+            session.conversation_history.append({"role": "user", "content": user_input})
+            if session.history_token_count is None:
+                session.history_token_count = sum(count_history_tokens(session.conversation_history, config['model']))
+            else:
+                session.history_token_count += count_message_tokens(session.conversation_history[-1], config['model'])
 
             # Get model max tokens
             model_info = get_model_info(config['model'])
@@ -2666,58 +3741,33 @@ def chat_with_model(config, conversation_history=None):
                 display_max_tokens = max_tokens
 
             # Check if we need to trim the conversation history
-            conversation_history, trimmed_count = manage_context_window(conversation_history, max_tokens=max_tokens, model_name=config['model'])
+            session.conversation_history, trimmed_count, session.history_token_count = manage_context_window(
+                session.conversation_history, max_tokens=max_tokens, model_name=config['model'],
+                precomputed_total=session.history_token_count
+            )
             if trimmed_count > 0:
+                session.removed_message_count += trimmed_count
                 console.print(f"[yellow]Note: Removed {trimmed_count} earlier messages to stay within the context window.[/yellow]")
 
-            # Clean conversation history for API - remove any messages with invalid fields
-            clean_conversation = []
-            for msg in conversation_history:
-                clean_msg = {
-                    "role": msg["role"],
-                    "content": msg["content"]
-                }
-                # Handle models that don't support system messages (like Gemma)
-                if clean_msg["role"] == "system":
-                    # Check if this is a Gemma model that doesn't support system messages
-                    if "gemma" in config['model'].lower():
-                        # Convert system message to user message with instructions
-                        if clean_msg["content"] and clean_msg["content"].strip():
-                            clean_msg["role"] = "user"
-                            clean_msg["content"] = f"Please follow these instructions: {clean_msg['content']}"
-                        else:
-                            # Skip empty system messages
-                            continue
-                    else:
-                        # Keep system message for models that support it
-                        pass
-                
-                # Only include valid roles for OpenRouter API
-                if clean_msg["role"] in ["system", "user", "assistant"]:
-                    clean_conversation.append(clean_msg)
-
-            # Update the API call to use streaming
-            data = {
-                "model": config['model'],
-                "messages": clean_conversation,
-                "temperature": config['temperature'],
-                "stream": True,
-            }
+            # The trim note goes between the system message and the retained history, so the
+            # system message stays a cacheable prefix and the user's turn stays last
+            trim_notes = [build_trim_note(session.removed_message_count)] if session.removed_message_count else []
+
+            # Serialize the request body; unchanged history messages reuse their encoded bytes
+            request_body = encode_chat_request(
+                config['model'], session.conversation_history, config['temperature'], trim_notes
+            )
 
             # Start timing the response
-            start_time = time.time()
-            timer_display = console.status("[bold cyan]⏱️ Waiting for response...[/bold cyan]")
+            start_time = time.monotonic()
+            timer_display = DelayedStatus("[bold cyan]⏱️ Waiting for response...[/bold cyan]")
             timer_display.start()
 
+            # Set once the assistant's reply is in the history; otherwise the user's message is withdrawn
+            reply_received = False
             try:
-                # Make streaming request
-                response = requests.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers=headers,
-                    json=data,
-                    stream=True,
-                    timeout=60  # Add a timeout
-                )
+                # Make streaming request over the shared keep-alive connection
+                response = post_chat_completion(headers, request_body)
 
                 if response.status_code == 200:
                     # Pass config['thinking_mode'] to stream_response
@@ -2725,10 +3775,13 @@ def chat_with_model(config, conversation_history=None):
 
                     # Only add to history if we got actual content
                     if message_content:
-                        response_times.append(response_time)
+                        session.response_times.append(response_time)
 
                         # Add assistant response to conversation history
-                        conversation_history.append({"role": "assistant", "content": message_content})
+                        session.conversation_history.append({"role": "assistant", "content": message_content})
+                        reply_received = True
+                        if session.history_token_count is not None:
+                            session.history_token_count += count_message_tokens(session.conversation_history[-1], config['model'])
 
                         # Use API-provided token counts if available, otherwise fallback to tiktoken
                         if usage_info:
@@ -2736,20 +3789,20 @@ def chat_with_model(config, conversation_history=None):
                             actual_completion_tokens = usage_info.get('completion_tokens', 0)
                             actual_total_tokens = usage_info.get('total_tokens', actual_prompt_tokens + actual_completion_tokens)
                             
-                            total_prompt_tokens += actual_prompt_tokens
-                            total_completion_tokens += actual_completion_tokens
-                            total_tokens_used += actual_total_tokens
+                            session.total_prompt_tokens += actual_prompt_tokens
+                            session.total_completion_tokens += actual_completion_tokens
+                            session.total_tokens_used += actual_total_tokens
                             
                             input_tokens = actual_prompt_tokens
                             response_tokens = actual_completion_tokens
                         else:
                             # Fallback to tiktoken estimation
                             response_tokens = count_tokens(message_content)
-                            total_tokens_used += input_tokens + response_tokens
-                            total_completion_tokens += response_tokens
+                            session.total_tokens_used += input_tokens + response_tokens
+                            session.total_completion_tokens += response_tokens
 
                         # Calculate cost for this exchange
-                        exchange_cost = calculate_session_cost(input_tokens, response_tokens, pricing_info)
+                        exchange_cost = calculate_session_cost(input_tokens, response_tokens, session.pricing_info)
 
                         # Display speed and token information
                         formatted_time = format_time_delta(response_time)
@@ -2767,16 +3820,13 @@ def chat_with_model(config, conversation_history=None):
                         console.print(token_display)
                         
                         if max_tokens:
-                            console.print(f"[dim]Total Tokens: {total_tokens_used:,} / {display_max_tokens:,}[/dim]")
+                            console.print(f"[dim]Total Tokens: {session.total_tokens_used:,} / {display_max_tokens:,}[/dim]")
                         
                         # Increment message count for successful exchanges
-                        message_count += 1
+                        session.message_count += 1
                     else:
                         # If we didn't get content but status was 200, something went wrong with streaming
                         console.print("[red]Error: Received empty response from API[/red]")
-                        # Remove the user's last message since we didn't get a response
-                        if conversation_history and conversation_history[-1]["role"] == "user":
-                            conversation_history.pop()
                 else:
                     # Try to get error details from response
                     try:
@@ -2805,22 +3855,16 @@ def chat_with_model(config, conversation_history=None):
                     except Exception:
                         console.print(f"[red]API Error: Status code {response.status_code}[/red]")
                         console.print(f"[red]{response.text}[/red]")
-
-                    # Remove the user's last message since we didn't get a response
-                    if conversation_history and conversation_history[-1]["role"] == "user":
-                        conversation_history.pop()
-            except requests.exceptions.RequestException as e:
+            except NETWORK_ERRORS as e:
                 console.print(f"[red]Network error: {str(e)}[/red]")
-                # Remove the user's last message since we didn't get a response
-                if conversation_history and conversation_history[-1]["role"] == "user":
-                    conversation_history.pop()
             except Exception as e:
                 console.print(f"[red]Error: {str(e)}[/red]")
-                # Remove the user's last message since we didn't get a response
-                if conversation_history and conversation_history[-1]["role"] == "user":
-                    conversation_history.pop()
             finally:
                 timer_display.stop()
+                # Remove the user's last message since we didn't get a response
+                if not reply_received and session.conversation_history and session.conversation_history[-1]["role"] == "user":
+                    session.conversation_history.pop()
+                    session.history_token_count = None
 
         except KeyboardInterrupt:
             current_time = time.time()
@@ -2839,22 +3883,24 @@ def chat_with_model(config, conversation_history=None):
 
 def create_chat_ui():
     """Creates a modern, attractive CLI interface using rich components"""
-    console.print(Panel.fit(
-        f"[bold blue]Or[/bold blue][bold green]Chat[/bold green] [dim]v{APP_VERSION}[/dim]\n"
-        "[dim]A powerful CLI for AI models via OpenRouter[/dim]",
-        title="🚀 Welcome",
-        border_style="green",
-        padding=(1, 2)
-    ))
-
-    # Display a starting tip
-    console.print(Panel(
-        "Type [bold green]/help[/bold green] for commands\n"
-        "[bold cyan]/model[/bold cyan] to change AI models\n"
-        "[bold yellow]/theme[/bold yellow] to customize appearance",
-        title="Quick Tips",
-        border_style="blue",
-        width=40
+    # Render the welcome panel and starting tip in a single print
+    console.print(Group(
+        Panel.fit(
+            f"[bold blue]Or[/bold blue][bold green]Chat[/bold green] [dim]v{APP_VERSION}[/dim]\n"
+            "[dim]A powerful CLI for AI models via OpenRouter[/dim]",
+            title="🚀 Welcome",
+            border_style="green",
+            padding=(1, 2)
+        ),
+        # Display a starting tip
+        Panel(
+            "Type [bold green]/help[/bold green] for commands\n"
+            "[bold cyan]/model[/bold cyan] to change AI models\n"
+            "[bold yellow]/theme[/bold yellow] to customize appearance",
+            title="Quick Tips",
+            border_style="blue",
+            width=40
+        ),
     ))
 
 def get_model_recommendations(task_type=None, budget=None):
@@ -2878,18 +3924,17 @@ def get_model_recommendations(task_type=None, budget=None):
             "chat": ["claude-3-haiku", "gpt-3.5", "gemini-pro", "llama"]
         }
 
-    recommended = []
-    task_model_patterns = task_categories.get(task_type, [])
-    
-    for model in all_models:
-        model_id = model.get('id', '').lower()
-        # Check if model matches any of the task-specific patterns/slugs
-        if any(pattern.lower() in model_id for pattern in task_model_patterns):
-            # Filter by budget if specified
-            if budget == "free" and ":free" in model['id']:
-                recommended.append(model)
-            elif budget is None or budget != "free":
-                recommended.append(model)
+    task_model_patterns = task_categories.get(task_type)
+    if not task_model_patterns:
+        return all_models
+
+    # One regex pass per lowercased model id checks every task-specific pattern/slug
+    pattern_search = compile_substring_patterns(task_model_patterns).search
+    free_only = budget == "free"
+    recommended = [
+        model for model in all_models
+        if pattern_search(model.get('id', '').lower()) and (not free_only or ":free" in model['id'])
+    ]
 
     return recommended or all_models
 
@@ -2900,13 +3945,15 @@ def main():
     parser.add_argument("--task", type=str, choices=["creative", "coding", "analysis", "chat"],
                         help="Optimize for specific task type")
     parser.add_argument("--image", type=str, help="Path to image file to analyze")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Don't mark prompts for provider-side prompt caching")
     args = parser.parse_args()
 
-    # Check if config exists
-    config_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.ini')
-    env_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env')
+    if args.no_cache:
+        prompt_cache['enabled'] = False
 
-    if args.setup or (not os.path.exists(config_file) and not os.path.exists(env_file)):
+    # Check if config exists
+    if args.setup or (not os.path.exists(CONFIG_FILE) and not os.path.exists(ENV_FILE)):
         config = setup_wizard()
         if config is None:
             console.print("[red]Setup failed. Cannot continue without proper configuration. Exiting.[/red]")
@@ -2917,11 +3964,8 @@ def main():
     # Show welcome UI
     create_chat_ui()
 
-    # Auto-check for updates on startup
-    try:
-        check_for_updates(silent=True)
-    except Exception:
-        pass  # Silently ignore update check failures
+    # Auto-check for updates on startup without waiting for GitHub
+    start_update_check()
 
     # Check if API key is set
     if not config['api_key'] or config['api_key'] == "<YOUR_OPENROUTER_API_KEY>":
@@ -2936,6 +3980,9 @@ def main():
             console.print("[red]Cannot continue without a valid API key. Exiting.[/red]")
             sys.exit(1)
 
+    # Startup changes below are written in one save_config call before the chat starts
+    config_changed = False
+
     # Handle task-specific model recommendation
     if args.task:
         recommended_models = get_model_recommendations(args.task)
@@ -2962,20 +4009,20 @@ def main():
                     index = int(choice) - 1
                     if 0 <= index < len(recommended_models[:5]):
                         config['model'] = recommended_models[index]['id']
-                        save_config(config)
+                        config_changed = True
                 except ValueError:
                     pass
 
     # Check if model is set or specified via command line
     if args.model:
         config['model'] = args.model
-        save_config(config)
+        config_changed = True
     elif not config['model']:
         console.print("[yellow]No model selected. Please choose a model.[/yellow]")
         selected_model = select_model(config)
         if selected_model:
             config['model'] = selected_model
-            save_config(config)
+            config_changed = True
         else:
             console.print("[red]Cannot continue without a valid model. Exiting.[/red]")
             sys.exit(1)
@@ -2986,8 +4033,13 @@ def main():
         # Set a default value without prompting
         config['system_instructions'] = "You are a helpful AI assistant."
         console.print("[yellow]No system instructions set. Using default instructions.[/yellow]")
+        config_changed = True
+
+    if config_changed:
         save_config(config)
 
+    announce_update_if_ready()
+
     # Handle image analysis if provided
     conversation_history = None
     if args.image: